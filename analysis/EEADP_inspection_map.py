@@ -24,7 +24,7 @@ disk_engine = create_engine('sqlite:///../get_data/AMEND.db')
 
 ## Get inspection data
 data_ins = pd.read_sql_query('SELECT * FROM MAEEADP_Inspection', disk_engine)
-data_ins['Year'] = pd.to_datetime(data_ins['InspectionDate']).apply(lambda x: x.year)
+data_ins['Year'] = pd.to_datetime(data_ins['InspectionDate'], format='ISO8601', errors='coerce').dt.year
 
 
 ##########################
@@ -10,6 +10,8 @@ extends it with placeholder rows (zero growth) for any years that appear in the
 data but not yet in the SSA CSV, so the database assembles without errors even if the
 SSA file lags behind.
 
+EEADP tables are loaded from their typed Parquet copies when present (see table_io.py).
+
 Outputs:
   AMEND.db             — SQLite database (local, then uploaded to GCS)
   gs://openamend-data/amend.db — GCS copy, served to the web app
@@ -19,6 +21,7 @@ import pandas as pd
 import datetime
 from sqlalchemy import create_engine
 import os
+from table_io import read_table
 
 if __name__ == '__main__':
 	## Establish database
@@ -40,11 +43,12 @@ if __name__ == '__main__':
 	data_csv['NECIR_CSO_2011'] = pd.read_csv('../docs/data/NECIR_CSO_2011.csv')
 
 	data_csv['MAEEADP_DrinkingWater'] = pd.read_csv('../docs/data/EEADP_drinkingWater_annual.csv')
+	data_csv['MAEEADP_DrinkingWater_Chemical'] = pd.read_csv('../docs/data/EEADP_drinkingWater_chemical_annual.csv')
 	#../docs/data/EEADP_drinkingWater_head.csv ## Don't include Drinking Water head file
-	data_csv['MAEEADP_Enforcement'] = pd.read_csv('../docs/data/EEADP_enforcement.csv')
-	data_csv['MAEEADP_Facility'] = pd.read_csv('../docs/data/EEADP_facility.csv')
-	data_csv['MAEEADP_Inspection'] = pd.read_csv('../docs/data/EEADP_inspection.csv')
-	data_csv['MAEEADP_Permit'] = pd.read_csv('../docs/data/EEADP_permit.csv')
+	data_csv['MAEEADP_Enforcement'] = read_table('../docs/data/EEADP_enforcement.csv')
+	data_csv['MAEEADP_Facility'] = read_table('../docs/data/EEADP_facility.csv')
+	data_csv['MAEEADP_Inspection'] = read_table('../docs/data/EEADP_inspection.csv')
+	data_csv['MAEEADP_Permit'] = read_table('../docs/data/EEADP_permit.csv')
 	data_csv['EPA_EJSCREEN_2017'] = pd.read_csv('../docs/data/EPA_EJSCREEN_MA_2017.csv')
 	data_csv['EPA_EJSCREEN_2023'] = pd.read_csv('../docs/data/EPA_EJSCREEN_MA_2023.csv')
 	data_csv['MAEEADP_CSO'] = pd.read_csv('../docs/data/EEADP_CSO.csv')
@@ -0,0 +1,44 @@
+"""Shared date normalization for the fetch scripts.
+
+Each date column is parsed once into a datetime64 column and calendar parts are derived
+from it with the vectorized `.dt` accessors, so missing or unparseable dates become NaT /
+<NA> without falling back to per-row Python.
+"""
+
+import pandas as pd
+
+# Massachusetts state fiscal years run July 1 - June 30 and are named for the year they end in
+FISCAL_YEAR_START_MONTH = 7
+
+DATE_PARTS = ('Year', 'Month', 'FiscalYear')
+
+
+def parse_dates(values: pd.Series) -> pd.Series:
+	"""Return `values` as datetime64, parsing ISO 8601 text; unparseable values become NaT."""
+	if pd.api.types.is_datetime64_any_dtype(values):
+		return values
+	return pd.to_datetime(values, format='ISO8601', errors='coerce')
+
+def add_date_parts(df: pd.DataFrame, date_col: str, parts: tuple=DATE_PARTS, prefix: str='') -> pd.DataFrame:
+	"""
+	Parse `date_col` once and add calendar columns derived from it.
+
+	Args:
+		df (DataFrame): Table to normalize
+		date_col (str): Column holding the dates
+		parts (tuple): Any of 'Year', 'Month', 'FiscalYear'
+		prefix (str): Prefix for the added column names, for tables with several date columns
+
+	Returns:
+		df: A new DataFrame with `date_col` as datetime64 and the requested parts as
+			nullable integer columns
+	"""
+	dates = parse_dates(df[date_col])
+	new_cols = {date_col: dates}
+	if 'Year' in parts:
+		new_cols[prefix + 'Year'] = dates.dt.year.astype('Int64')
+	if 'Month' in parts:
+		new_cols[prefix + 'Month'] = dates.dt.month.astype('Int64')
+	if 'FiscalYear' in parts:
+		new_cols[prefix + 'FiscalYear'] = (dates.dt.year + (dates.dt.month >= FISCAL_YEAR_START_MONTH)).astype('Int64')
+	return df.assign(**new_cols)
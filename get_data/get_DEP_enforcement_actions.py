@@ -1,16 +1,17 @@
 from __future__ import absolute_import
 from __future__ import print_function
 from bs4 import BeautifulSoup
-import six.moves.urllib.request, six.moves.urllib.error, six.moves.urllib.parse
-import pickle
 import pandas as pd
 from unidecode import unidecode
 import re
 import numpy as np
 import datetime
 import os
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from six.moves import range
-from six.moves import zip
+
+from http_cache import cached_get
 
 
 proper_noun_regexp = r'(?:\s*\b[A-Z][a-z\-]+\b)+'
@@ -26,48 +27,85 @@ years = list(range(2004, datetime.date.today().year+1))
 
 ## Download DEP enforcement news archives
 base_url = "http://www.mass.gov/eea/agencies/massdep/service/enforcement/enforcement-actions-{}.html"
-all_urls = [base_url.format(i) for i in years]
-all_content = [six.moves.urllib.request.urlopen(url).read() for url in all_urls]
-with open('DEP_enforcement_pages.p', 'w') as f: pickle.dump(all_content, f)
-
-## Iterate through content
-all_soups = [BeautifulSoup(c, "lxml") for c in all_content]
-all_content_list = []
-for year, soup in zip(years, all_soups):
-	print(year)
-	divs = soup.findAll('div')
-	div_i = [i for i in range(len(divs)) if 'class' in divs[i].attrs and divs[i].attrs['class'] == ['col','col12','bodyfield']] # identify which div has the enforcement data - this can change when alerts, etc. are temporarily posted to the site
-	assert(len(div_i) == 1)
-	div_i = div_i[0]
-	pars = divs[div_i].findAll('p')
-	for par in pars:
+
+## Parsed paragraphs for each year are cached here; past years' archives don't change, so
+## normally only the current year's page is re-fetched and re-parsed.  Delete a year's
+## file to force it to be refreshed.
+YEAR_CACHE_DIR = 'DEP_enforcement_years'
+MAX_WORKERS = 8
+
+date_par_regexp_c = re.compile(r'^[0-9]{1,2}\/[0-9]{1,2}\/[0-9]{2,4}:')
+def parse_year(year, content):
+	"""
+	Return the (year, date, text) enforcement paragraphs from one year's archive page
+	"""
+	soup = BeautifulSoup(content, "lxml")
+	## identify which div has the enforcement data - this can change when alerts, etc. are temporarily posted to the site
+	divs = [d for d in soup.find_all('div', class_='bodyfield') if d.attrs['class'] == ['col','col12','bodyfield']]
+	assert(len(divs) == 1)
+	year_content = []
+	for par in divs[0].find_all('p'):
 		## Check that this paragraph starts with a date
 		pt = par.get_text()
-		if re.match('^[0-9]{1,2}\/[0-9]{1,2}\/[0-9]{2,4}:', pt) is not None:
+		if date_par_regexp_c.match(pt) is not None:
 			p_date = pt.split(':')[0]
 			p_text = pt.split(':')[1].lstrip()
-			all_content_list += [(year, p_date, p_text)]
+			year_content += [(year, p_date, p_text)]
+	return year_content
+
+def year_cache_path(year):
+	return os.path.join(YEAR_CACHE_DIR, str(year) + '.json')
+
+def fetch_year(year):
+	"""
+	Fetch and parse one year's archive page and cache the parsed paragraphs
+	"""
+	r = cached_get(base_url.format(year))
+	r.raise_for_status()
+	year_content = parse_year(year, r.content)
+	if year < datetime.date.today().year:
+		with open(year_cache_path(year) + '.tmp', 'w') as f:
+			json.dump(year_content, f)
+		os.replace(year_cache_path(year) + '.tmp', year_cache_path(year))
+	return year_content
+
+def load_year(year):
+	with open(year_cache_path(year)) as f:
+		return [tuple(par) for par in json.load(f)]
+
+os.makedirs(YEAR_CACHE_DIR, exist_ok=True)
+year_content = {}
+fetch_years = [year for year in years if year == years[-1] or not os.path.exists(year_cache_path(year))]
+for year in years:
+	if year not in fetch_years:
+		year_content[year] = load_year(year)
+print(f'Loaded {len(year_content)} years from cache; fetching {fetch_years}')
+## Fetch and parse the remaining years concurrently, as each page arrives
+with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+	futures = {executor.submit(fetch_year, year): year for year in fetch_years}
+	for future in as_completed(futures):
+		year_content[futures[future]] = future.result()
+		print(futures[future])
+all_content_list = [par for year in years for par in year_content[year]]
 
 ## Setup output data frame
 DEP_df = pd.DataFrame(data = np.array(all_content_list), columns = ['Year','Date','Text'])
 DEP_df.Text = DEP_df.Text.apply(unidecode)
 
 ## Fix some by hand
-DEP_df_replacements = {
-	r'''MassDEP entered into a Consent Order with a $53, 938 Penalty involving Charles Wilmot, a home improvement contractor, for Air Quality (Asbestos) violations at a work site in Worcester. Due to financial hardship information provided by Wilmot, MassDEP agreed to suspend the Penalty provided Wilmot remain in compliance with state's air regulations.4/27/06''': '''MassDEP entered into a Consent Order with a $53,938 Penalty involving Charles Wilmot, a home improvement contractor, for Air Quality (Asbestos) violations at a work site in Worcester. Due to financial hardship information provided by Wilmot, MassDEP agreed to suspend the Penalty provided Wilmot remain in compliance with state's air regulations.4/27/06''',
-	r'''MassDEP entered into a Consent Order with a $67,8200 Penalty involving Glyptal, Inc. of Chelsea for Waste Site Cleanup violations. 305 Eastern Avenue, Chelsea for continued violations of M.G.L c 21C. Within 180 days of the effective date of the Consent Order $3,500 is due with the balance of $64,320 payable with 30 days of a DEP Demand Notice as a result of non-compliance with the ACO.''':r'''MassDEP entered into a Consent Order with a $67,820 Penalty involving Glyptal, Inc. of Chelsea for Waste Site Cleanup violations. 305 Eastern Avenue, Chelsea for continued violations of M.G.L c 21C. Within 180 days of the effective date of the Consent Order $3,500 is due with the balance of $64,320 payable with 30 days of a DEP Demand Notice as a result of non-compliance with the ACO.''',
-	r'''MassDEP entered into a Consent Order with a $23, 950 Penalty involving Pride Ford and Pride Dodge of North Attleboro for Hazardous Waste violations. Inspections by MassDEP revealed the facilities had not complied with the''':r'''MassDEP entered into a Consent Order with a $23,950 Penalty involving Pride Ford and Pride Dodge of North Attleboro for Hazardous Waste violations. Inspections by MassDEP revealed the facilities had not complied with the''',
-	r'''MassDEP entered into a Consent Order with a $9.750 Penalty involving the King Phillip Realty Trust of Raynham. The Trust was operating a public water supply without MassDEP approval. A previous notice of noncompliance was issued against this particular facility. The Trust has now agreed to either, register - and conduct testing - or connects to an existing water supplier.''':r'''MassDEP entered into a Consent Order with a $9,750 Penalty involving the King Phillip Realty Trust of Raynham. The Trust was operating a public water supply without MassDEP approval. A previous notice of noncompliance was issued against this particular facility. The Trust has now agreed to either, register - and conduct testing - or connects to an existing water supplier.''',
-	r'''MassDEP executed a Consent Order with a $30.000 Penalty involving Mohammad Al Omari for Waste Site Cleanup violations at 454 Water Street in Wakefield. Mohammad Al Omari is the owner and/or operator of the property at 454 Water Street where violations including failure to meet deadlines set out in previously-issued notice of noncompliance dated 6/12/13.  Today's Order requires a tier two cleanup permit transfer and tier two extension by 2/28/14; a phase three remedial alternatives analysis report for the site which meets the requirements by 4/30/14; and, phase four remedial implementation report for the site which meets the requirements by 7/30/14.  Finally, by 7/30/14, the respondent shall submit to MassDEP a response action final outcome statement or a remedy operation status whic9h meets the requirements for the site. Under the terms of today's Order, the respondent has agreed to pay $5,000 of the Penalty with the remaining $25,000 suspended pending compliance with the terms of the Order and meeting all the required deadlines.''':r'''MassDEP executed a Consent Order with a $30,000 Penalty involving Mohammad Al Omari for Waste Site Cleanup violations at 454 Water Street in Wakefield. Mohammad Al Omari is the owner and/or operator of the property at 454 Water Street where violations including failure to meet deadlines set out in previously-issued notice of noncompliance dated 6/12/13.  Today's Order requires a tier two cleanup permit transfer and tier two extension by 2/28/14; a phase three remedial alternatives analysis report for the site which meets the requirements by 4/30/14; and, phase four remedial implementation report for the site which meets the requirements by 7/30/14.  Finally, by 7/30/14, the respondent shall submit to MassDEP a response action final outcome statement or a remedy operation status whic9h meets the requirements for the site. Under the terms of today's Order, the respondent has agreed to pay $5,000 of the Penalty with the remaining $25,000 suspended pending compliance with the terms of the Order and meeting all the required deadlines. ''',
-	r'''MassDEP issued a $2.524 Penalty Assessment Notice to Lamberto's Garage for Air Quality (Stage II vapor recovery) violations in Franklin. Inspections in 2007 by MassDEP found failures to perform in-use compliance tests on vapor recovery systems at this gasoline dispensing facility and other recordkeeping violations. Efforts to reach a negotiated settlement of this enforcement action were unsuccessful.''':r'''MassDEP issued a $2,524 Penalty Assessment Notice to Lamberto's Garage for Air Quality (Stage II vapor recovery) violations in Franklin. Inspections in 2007 by MassDEP found failures to perform in-use compliance tests on vapor recovery systems at this gasoline dispensing facility and other recordkeeping violations. Efforts to reach a negotiated settlement of this enforcement action were unsuccessful.''',
-	r'''DEP executed a Consent Order with a $9.250 Penalty involving Boston and Main Corporation for hazardous waste violations at its facility in East Deerfield. B&M, with offices located in North Billerica, was cited for hazardous waste management violations discovered during a DEP inspection on 6/30/04. Waste oil had been stored at this facility in excess of the time limit allowed under state regulations. As part of the settlement agreement, Boston & Maine has agreed to implement measures to prevent this violation from reoccurring.''':r'''DEP executed a Consent Order with a $9,250 Penalty involving Boston and Main Corporation for hazardous waste violations at its facility in East Deerfield. B&M, with offices located in North Billerica, was cited for hazardous waste management violations discovered during a DEP inspection on 6/30/04. Waste oil had been stored at this facility in excess of the time limit allowed under state regulations. As part of the settlement agreement, Boston & Maine has agreed to implement measures to prevent this violation from reoccurring.''',
-	r'''MassDEP entered into a Consent Order with a $39.000 Penalty involving M.K. Realty Trust for Water Pollution Control violations in Tewksbury.Robert Scarano, President of M.K. Realty Trust, failed to obtain a sewer extension permit before building eight residential townhouse condominiums (16 condos), a twelve-room bed and breakfast, new road (Preservation Lane) and temporary sewage pump station. The pump station will be in use until such time as the town's expanding sewer system can receive flows by gravity. The new road had already been constructed and most of the condos sold and occupied. Once the Respondent obtains Massachusetts Historical Commission approval for the project and site, the sewer permitting process will resume. MassDEP has agreed to suspend $28,000 of the Penalty provided all terms of the Order are met.''':r'''MassDEP entered into a Consent Order with a $39,000 Penalty involving M.K. Realty Trust for Water Pollution Control violations in Tewksbury.Robert Scarano, President of M.K. Realty Trust, failed to obtain a sewer extension permit before building eight residential townhouse condominiums (16 condos), a twelve-room bed and breakfast, new road (Preservation Lane) and temporary sewage pump station. The pump station will be in use until such time as the town's expanding sewer system can receive flows by gravity. The new road had already been constructed and most of the condos sold and occupied. Once the Respondent obtains Massachusetts Historical Commission approval for the project and site, the sewer permitting process will resume. MassDEP has agreed to suspend $28,000 of the Penalty provided all terms of the Order are met.''',
-	r'''MassDEP entered into a Consent Order with the Cambridge Public Health Commission, which owns and operates facilities in Everett, Somerville and Cambridge, for Air Quality and Hazardous Waste Management violations. The Cambridge Public Health Commission ("CPHC") operates three non-profit hospitals (Whidden Memorial Hospital in Everett, Somerville Hospital and Cambridge Hospital). At these three facilities, MassDEP observed various violations for which CPHC has now agreed to pay a $47, 130 Penalty ($12,630 of which is for missed compliance fees) and MassDEP has agreed to suspend $14,500 of the total pending full compliance over the next year.''':r'''MassDEP entered into a Consent Order with the Cambridge Public Health Commission, which owns and operates facilities in Everett, Somerville and Cambridge, for Air Quality and Hazardous Waste Management violations. The Cambridge Public Health Commission ("CPHC") operates three non-profit hospitals (Whidden Memorial Hospital in Everett, Somerville Hospital and Cambridge Hospital). At these three facilities, MassDEP observed various violations for which CPHC has now agreed to pay a $47,130 Penalty ($12,630 of which is for missed compliance fees) and MassDEP has agreed to suspend $14,500 of the total pending full compliance over the next year.''',
-	r'''MassDEP entered into a Consent Order with a $53, 938 Penalty involving Charles Wilmot, a home improvement contractor, for Air Quality (Asbestos) violations at a work site in Worcester. Due to financial hardship information provided by Wilmot, MassDEP agreed to suspend the Penalty provided Wilmot remain in compliance with state's air regulations.4/27/06''':r'''MassDEP entered into a Consent Order with a $53,938 Penalty involving Charles Wilmot, a home improvement contractor, for Air Quality (Asbestos) violations at a work site in Worcester. Due to financial hardship information provided by Wilmot, MassDEP agreed to suspend the Penalty provided Wilmot remain in compliance with state's air regulations.4/27/06''',
-	}
-
-for g in DEP_df_replacements:
-	DEP_df.Text[DEP_df.Text == g] = DEP_df_replacements[g]
+## Corrections are whole-paragraph replacements kept in a versioned data file; they are
+## applied in one lookup pass, and any that no longer match the archive text are reported
+## so they can be updated or dropped.
+CORRECTIONS_FILE = 'DEP_enforcement_corrections.json'
+with open(CORRECTIONS_FILE) as f:
+	corrections = json.load(f)
+DEP_df_replacements = {c['text']: c['corrected'] for c in corrections['corrections']}
+archive_text = set(DEP_df.Text)
+unmatched = [g for g in DEP_df_replacements if g not in archive_text]
+DEP_df['Text'] = DEP_df.Text.map(DEP_df_replacements).fillna(DEP_df.Text)
+print(f"Applied {len(DEP_df_replacements) - len(unmatched)} of {len(DEP_df_replacements)} text corrections from {CORRECTIONS_FILE} (version {corrections['version']})")
+for g in unmatched:
+	print('Correction no longer matches: ' + g[:80])
 
 
 ####  Parse and annotate data
@@ -78,35 +116,51 @@ order_types = ['consent order', 'unilateral order', 'demand', 'demand notice', '
 	       'attorney general', 'water','hazardous waste', 'sewer',
 	       'civil penalty',' supplemental environmental project', 'gasoline', 'asbestos', 'wetlands',
 	       'stormwater']
-for order in order_types:
-	DEP_df['order_'+order] = DEP_df.Text.str.lower().str.contains(order)
-
 law_types = [['npdes','National Pollution Discharge Elimination System'],['chapter 91', 'ch 91']]
+
+## Index every keyword by the flag columns it sets, and find all of them in one pass with
+## a lookahead regex.  Alternatives are tried longest first, so a match at a position is the
+## longest keyword there and any shorter keyword it starts with (e.g. 'demand' in 'demand
+## notice') is implied by it.
+keyword_columns = {}
+for order in order_types:
+	keyword_columns.setdefault(order, []).append('order_'+order)
 for law in law_types:
-	DEP_df['law_'+law[0]] = DEP_df.Text.str.lower().apply(lambda x: np.any([g in x for g in law]))
+	for g in law:
+		keyword_columns.setdefault(g.lower(), []).append('law_'+law[0])
+keyword_implies = {k: sorted(set(c for g in keyword_columns if k.startswith(g) for c in keyword_columns[g])) for k in keyword_columns}
+keyword_regexp = '(?=(' + '|'.join(re.escape(k) for k in sorted(keyword_columns, key=len, reverse=True)) + '))'
+flag_columns = ['order_'+order for order in order_types] + ['law_'+law[0] for law in law_types]
+
+text_lower = DEP_df.Text.str.lower()
+keyword_hits = text_lower.str.extractall(keyword_regexp)[0].map(keyword_implies).explode()
+flags = pd.get_dummies(keyword_hits).groupby(level=0).any()
+DEP_df[flag_columns] = flags.reindex(index=DEP_df.index, columns=flag_columns, fill_value=False).astype(bool)
 
 ## Add inferred cost
+## Take the first dollar amount in the text, scaled by a million if it is followed by "million"
 currency_match = r'\$[0-9]{1,3}(?:,?[0-9]{3})*(?:\.[0-9]{2})?\b'
 currency_match_millions = r'\$[0-9]{1,3}(?:,?[0-9]{3})*(?:\.{0,2}[0-9]{0,2} million)\b'
-def get_dollars(x):
-	a = re.search(currency_match, x)
-	## Seems to just return the first number from the string
-	if a:
-		## check if first group is a million
-		b = re.search(currency_match_millions, x)
-		if b and b.group(0).split('.')[0].split()[0] == a.group(0):
-			return float(b.group(0).replace(',','').replace('$','').split()[0])*1e6
-		else:
-			return float(a.group(0).replace(',','').replace('$',''))
-	else:
-		return np.nan
-
-DEP_df['Fine'] = DEP_df.Text.apply(get_dollars)
+def dollar_amounts(s):
+	## Amounts that still don't parse (e.g. "$2..5 million") become NaN
+	return pd.to_numeric(s.str.replace(',', '', regex=False).str.replace('$', '', regex=False).str.split().str[0], errors='coerce')
+
+first_amount = DEP_df.Text.str.extract('(' + currency_match + ')', expand=False)
+first_millions = DEP_df.Text.str.extract('(' + currency_match_millions + ')', expand=False)
+is_millions = first_millions.str.split('.').str[0].str.split().str[0] == first_amount
+DEP_df['Fine'] = dollar_amounts(first_amount)
+DEP_df.loc[is_millions, 'Fine'] = dollar_amounts(first_millions[is_millions])*1e6
 
 ## Annotate towns
 pop_inc_data = pd.read_csv('../docs/data/Census_ACS_MA.csv')
 pop_inc_data.index = pop_inc_data['Subdivision']
-DEP_df['municipality'] = DEP_df.Text.apply(extract_proper_nouns).apply(lambda x: [town for town in pop_inc_data['Subdivision'] if town in x])
+## A town is tagged when it is one of the paragraph's proper nouns, so index the towns by
+## name and look each proper noun up once; towns are listed in Census table order
+town_order = {town: i for i, town in enumerate(pop_inc_data['Subdivision'])}
+def match_towns(s):
+	return sorted(set(noun for noun in extract_proper_nouns(s) if noun in town_order), key=town_order.get)
+
+DEP_df['municipality'] = DEP_df.Text.apply(match_towns)
 
 ##Add in municipal population data, averaging when multiple are listed (obviously not the ideal in every case)
 def pop_inc_data_avg(towns, col):
@@ -15,8 +15,23 @@ import pandas as pd
 import sodapy
 import datetime
 import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from http_cache import UPSTREAM_URL, retrying_adapter
+from table_io import data_path
 
 DEP_SLUG = "rr3a-7twk"
+SODA_DOMAIN = "cthru.data.socrata.com"
+STAFF_CSV = data_path('MADEP_staff_SODA.csv')
+
+## Payroll years before the previous one are final, so an incremental run (the default once
+## STAFF_CSV exists) re-queries only the current and previous year and keeps the rest of the
+## CSV.  Pass --full to download every year again.
+INCREMENTAL_YEARS = 2
+MAX_WORKERS = 4
 
 ### Load credentials - you need to sign up for a SODA account to register a token
 with open('SECRET_SODA_token', 'r') as f:
@@ -38,32 +53,78 @@ fields = {
 	u'year': int
 }
 
-client = sodapy.Socrata("cthru.data.socrata.com", app_token=app_token)#, access_token=secret_token)
+def _make_client():
+	"""
+	Return a Socrata client that retries transient errors, sent to AMEND_UPSTREAM_URL if set
+	"""
+	domain, prefix = SODA_DOMAIN, 'https://'
+	if UPSTREAM_URL:
+		upstream = urlsplit(UPSTREAM_URL)
+		domain, prefix = upstream.netloc, upstream.scheme + '://'
+	return sodapy.Socrata(domain, app_token=app_token, timeout=60,
+		session_adapter={'prefix': prefix, 'adapter': retrying_adapter()})#, access_token=secret_token
+
+_thread_local = threading.local()
+
+def _get_client():
+	"""
+	Return the calling thread's Socrata client, creating it on first use
+	"""
+	if not hasattr(_thread_local, 'client'):
+		_thread_local.client = _make_client()
+	return _thread_local.client
 
 query_limit=50000
-i = 0; df_d = []
-## Page through records
-while i == 0 or len(df_d[-1]) == query_limit: 
-	print(f'Loading record page: {i}')
-	df_d += [client.get(DEP_SLUG, 
-		where="department_division = 'DEPARTMENT OF ENVIRONMENTAL PROTECTION (EQE)'",
-		select = ','.join(list(fields.keys())),
-		limit = query_limit, offset=i
-		)]
-	i += query_limit
+where = "department_division = 'DEPARTMENT OF ENVIRONMENTAL PROTECTION (EQE)'"
 
-df = pd.concat([pd.DataFrame(d) for d in df_d])
-
-for f in fields: df[f] = df[f].astype(fields[f])
+def get_page(where, offset):
+	print(f'Loading record page: {offset}')
+	## Pages are ordered by row id so that concurrent offset pages neither overlap nor skip rows
+	return _get_client().get(DEP_SLUG,
+		where=where,
+		select = ','.join(list(fields.keys())),
+		order = ':id',
+		limit = query_limit, offset=offset
+		)
+
+def get_records(where):
+	"""
+	Count the records matching `where`, then download all of their pages concurrently
+	"""
+	n_records = int(_get_client().get(DEP_SLUG, where=where, select='count(*) AS n')[0]['n'])
+	offsets = list(range(0, n_records, query_limit)) or [0]
+	print(f'{n_records} records in {len(offsets)} pages')
+	with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+		pages = list(executor.map(lambda offset: get_page(where, offset), offsets))
+	## Keep paging if records were added after the count
+	while len(pages[-1]) == query_limit:
+		pages += [get_page(where, offsets[-1] + query_limit)]
+		offsets += [offsets[-1] + query_limit]
+	return [r for page in pages for r in page]
+
+def set_types(df):
+	for f in fields: df[f] = df[f].astype(fields[f])
+	return df
+
+incremental = '--full' not in sys.argv and os.path.exists(STAFF_CSV)
+if incremental:
+	## Keep prior years from the existing file and replace the recent ones
+	old_df = set_types(pd.read_csv(STAFF_CSV, dtype={f: str for f in fields if fields[f] is str}))
+	min_year = datetime.date.today().year - INCREMENTAL_YEARS + 1
+	print(f'Updating {STAFF_CSV} from {min_year}')
+	new_df = set_types(pd.DataFrame.from_records(get_records(where + f" AND year >= {min_year}"), columns=list(fields.keys())))
+	df = pd.concat([old_df[old_df.year < min_year], new_df], ignore_index=True)
+else:
+	df = set_types(pd.DataFrame.from_records(get_records(where), columns=list(fields.keys())))
 
 ## Write out
-df.to_csv('../docs/data/MADEP_staff_SODA.csv', index=0)
+df.to_csv(STAFF_CSV, index=0)
 
 ## Print a sample of the file as an example
-df.sample(n=10).to_csv('../docs/data/MADEP_staff_SODA_sample.csv', index=0)
+df.sample(n=10).to_csv(data_path('MADEP_staff_SODA_sample.csv'), index=0)
 
 ## Report last update
-with open('../docs/data/ts_update_MADEP_staff_SODA.yml', 'w') as f:
+with open(data_path('ts_update_MADEP_staff_SODA.yml'), 'w') as f:
 	f.write('updated: '+str(datetime.datetime.now()).split('.')[0]+'\n')
 
 
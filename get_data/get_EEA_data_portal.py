@@ -7,27 +7,72 @@ Queries five tables via the DataLake REST API using paginated GET requests.  Res
 written to CSV files under docs/data/.  The large drinkingWater table (>200 MB) is also
 uploaded to GCS; an annualized summary is kept locally.
 
+The five tables are fetched as independent pipelines in parallel; a global semaphore
+(MAX_PORTAL_REQUESTS) limits requests in flight across all of them, and a failure in one
+table is reported after the others have finished and been written.
+
 HTTP requests use a session with automatic retries (5 attempts, exponential backoff) to
-tolerate transient 5xx / 429 errors from the portal.
+tolerate transient 5xx / 429 errors from the portal.  Once the table size is known, the
+_start/_end windows are requested in parallel by a small thread pool (MAX_WORKERS, one
+session per thread) and reassembled in window order.
+
+Each JSON page is decoded straight into typed columns (TABLE_SCHEMAS): categoricals for
+labels such as Town and Program, datetimes, and numerics.  Dates are written back out in
+the portal's ISO format, and Year, Month and FiscalYear columns are derived from each
+table's main date column (TABLE_DATE_COLS) with the shared date_utils helpers.
+
+The drinkingWater table is streamed: each page is appended to the output CSV and fed to
+running aggregators (the DW_SUMMARIES tables and a random sample), so peak memory is a few pages
+rather than the whole table.
+
+By default each table is synced incrementally: the previous row count, columns and latest
+date are kept in ../docs/data/EEADP_sync_state.json and only the tail of the table (plus
+one overlapping window to catch late edits) is re-requested and merged into the existing
+local CSV by Id.  The drinkingWater snapshot is not in the repository, so it is first
+downloaded from GCS when there is no local copy.
+
+Every completed window is checkpointed under EEADP_checkpoints/<table>/ with a JSON
+manifest, so rerunning after a dropped connection only requests the missing windows.
+
+Window sizes adapt to the portal: they shrink when a request needed retries or ran slowly
+and grow when responses are fast (see _PageSizer).  Requests, rows, bytes, retries and
+time spent per table are printed at the end of the run and written to
+EEADP_fetch_report.csv.  A shrinking count, changed columns, or a missing snapshot triggers a
+full refresh; delete the state file or call main(incremental=False) to force one.
 
 CSO data is handled separately in get_eea_dp_cso.py because it uses a different API.
 
-Outputs (per table, e.g. 'permit'):
+Outputs (per table, e.g. 'permit'; in ../docs/data, or AMEND_OUTPUT_DIR if set):
   ../docs/data/EEADP_permit.csv         — full table
+  ../docs/data/EEADP_permit.parquet     — full table with column types (if AMEND_WRITE_PARQUET=1)
   ../docs/data/EEADP_permit_sample.csv  — 10-row sample
   gs://openamend-data/EEADP_drinkingWater.csv — full drinking water table (GCS only)
-  ../docs/data/EEADP_drinkingWater_annual.csv — annualized summary
+  gs://openamend-data/EEADP_drinkingWater.parquet — typed copy of the same (if AMEND_WRITE_PARQUET=1)
+  ../docs/data/EEADP_drinkingWater_annual.csv — tests per year per PWS and contaminant group
+  ../docs/data/EEADP_drinkingWater_chemical_annual.csv — tests per year per chemical
+  gs://openamend-data/EEADP_drinkingWater_latest.csv — latest result per site and chemical
   ../docs/data/ts_update_EEADP.yml      — timestamp of last run
+  ../docs/data/EEADP_sync_state.json    — per-table high-water marks for incremental sync
 """
 
 import os
 import datetime
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+import json
+import shutil
+from typing import Optional
 import pandas as pd
+from pandas.api.types import union_categoricals
 import numpy as np
 
+from date_utils import add_date_parts, parse_dates
+from http_cache import cached_get, get_session
+from table_io import data_path
+
 ##########################
 ## API parameters
 ##########################
@@ -35,6 +80,128 @@ import numpy as np
 API_ROOT = 'http://eeaonline.eea.state.ma.us/EEA/DataLake/V1.0/DataLakeAPI/'
 API_TABLES = ['permit', 'facility', 'inspection', 'enforcement', 'drinkingWater']
 
+# Column types for each table; columns not listed are kept as (nullable) strings.
+# 'category' suits low-cardinality labels, dates are ISO 8601 strings from the portal,
+# and codes with leading zeros (PWSId, SampleLocCode) or mixed text such as 'ND' (Result)
+# are deliberately left as strings.
+TABLE_SCHEMAS = {
+	'permit': {
+		'PermitType': 'category',
+		'Subtype': 'category',
+		'Program': 'category',
+		'Town': 'category',
+		'Status': 'category',
+		'FacilityId': 'Int64',
+		'FinalDecisionDate': 'datetime',
+		'DateApplied': 'datetime',
+		},
+	'facility': {
+		'Id': 'Int64',
+		'Town': 'category',
+		'FacilityType': 'category',
+		'Program': 'category',
+		'Active': 'boolean',
+		},
+	'inspection': {
+		'Id': 'Int64',
+		'Town': 'category',
+		'Program': 'category',
+		'FacilityId': 'Int64',
+		'InspectionType': 'category',
+		'InspectionDate': 'datetime',
+		},
+	'enforcement': {
+		'Id': 'Int64',
+		'Town': 'category',
+		'Program': 'category',
+		'EnforcementType': 'category',
+		'PenaltyAssessed': 'float',
+		'FacilityId': 'Int64',
+		'EnforcementDate': 'datetime',
+		},
+	'drinkingWater': {
+		'Id': 'Int64',
+		'PWSName': 'category',
+		'Town': 'category',
+		'Class': 'category',
+		'ContaminantGroup': 'category',
+		'ChemicalName': 'category',
+		'CollectedDate': 'datetime',
+		'RaworFinished': 'category',
+		'Method': 'category',
+		'DetectionLimit': 'float',
+		'DefContamLimit': 'float',
+		'DefContamLimituom': 'category',
+		},
+	}
+
+# Summaries of the drinkingWater table computed while it streams (see SummaryAggregator).
+# 'count' summaries count non-null Results per group; 'latest' keeps the most recent
+# record per group.  Summaries marked 'gcs' are too large for the repository and are
+# uploaded next to the full table instead of written to docs/data/.
+DW_SUMMARIES = {
+	## Tests per year per PWS per contaminant group per raw/finished
+	'annual': {'type': 'count', 'keys': ['Year', 'PWSName', 'ContaminantGroup', 'RaworFinished']},
+	## Tests per year per chemical, statewide
+	'chemical_annual': {'type': 'count', 'keys': ['Year', 'ContaminantGroup', 'ChemicalName', 'RaworFinished']},
+	## Most recent report for each chemical for each site (~20% of the full table)
+	'latest': {'type': 'latest', 'keys': ['PWSName', 'LocationName', 'ChemicalName'],
+		'cols': ['PWSId', 'Town', 'ContaminantGroup', 'RaworFinished', 'Result', 'ResultWithUnit', 'DefContamLimitWithUnits'],
+		'gcs': True},
+	}
+
+# Datetimes are written back out in the portal's own format
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+# Typed Parquet copies are written alongside the CSVs only when AMEND_WRITE_PARQUET=1 is set
+# (and pyarrow is installed), so scheduled runs do not commit binary files under docs/data/
+WRITE_PARQUET = os.environ.get('AMEND_WRITE_PARQUET', '0') not in ('', '0')
+if WRITE_PARQUET:
+	try:
+		import pyarrow
+	except ImportError:
+		print('AMEND_WRITE_PARQUET is set but pyarrow is not installed; writing CSV only')
+		WRITE_PARQUET = False
+
+# Number of windows requested from the portal at once per table
+MAX_WORKERS = 4
+
+# Tables are fetched in parallel; this caps requests in flight across all of them so
+# the portal is not overloaded
+MAX_PORTAL_REQUESTS = 6
+MAX_TABLE_WORKERS = len(API_TABLES)
+
+# Bounds for adaptive window sizing; windows slower than TARGET_REQ_SECONDS shrink
+MIN_REQ_SIZE = 10000
+MAX_REQ_SIZE = 250000
+TARGET_REQ_SECONDS = 60
+
+# Per-table fetch telemetry from the last run (local only)
+FETCH_REPORT_FILE = 'EEADP_fetch_report.csv'
+
+# Portal responses are revalidated through the shared HTTP cache on every request; raise
+# this (or set AMEND_HTTP_CACHE_TTL) to replay cached windows while debugging
+PORTAL_CACHE_TTL = 0
+
+# Completed windows are saved here so an interrupted run can resume; removed once a table finishes
+CHECKPOINT_DIR = 'EEADP_checkpoints'
+
+# Checkpoints older than this (seconds) are discarded rather than resumed; data is refreshed
+# weekly, so a checkpoint left by a failed run is not reused by the next scheduled run
+CHECKPOINT_MAX_AGE = 6 * 24 * 3600
+
+# Per-table high-water marks for incremental sync; committed alongside the CSVs by CI
+SYNC_STATE_FILE = data_path('EEADP_sync_state.json')
+
+# Date column used as each table's high-water mark (facility has none)
+TABLE_DATE_COLS = {
+	'permit': 'FinalDecisionDate',
+	'facility': None,
+	'inspection': 'InspectionDate',
+	'enforcement': 'EnforcementDate',
+	'drinkingWater': 'CollectedDate',
+	}
+
 
 ##########################
 ## Function definitions
@@ -44,104 +211,721 @@ API_TABLES = ['permit', 'facility', 'inspection', 'enforcement', 'drinkingWater'
 REQ_HEADER = {'User-Agent':
 	'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/113.0.0.0 Safari/537.36'}
 
-def _make_session() -> requests.Session:
-	"""Return a requests Session with automatic retries on transient errors."""
-	session = requests.Session()
-	retry = Retry(
-		total=5,
-		backoff_factor=2,
-		status_forcelist=[429, 500, 502, 503, 504],
-	)
-	session.mount('http://', HTTPAdapter(max_retries=retry))
-	session.mount('https://', HTTPAdapter(max_retries=retry))
-	return session
+_portal_slots = threading.BoundedSemaphore(MAX_PORTAL_REQUESTS)
+_sync_state_lock = threading.Lock()
+
+def _convert_values(values, kind: str):
+	"""Convert a list or Series of raw values to one TABLE_SCHEMAS column type."""
+	if kind == 'datetime':
+		return pd.to_datetime(values, format='ISO8601', errors='coerce')
+	if kind == 'float':
+		return pd.to_numeric(values, errors='coerce')
+	if kind == 'Int64':
+		return pd.Series(pd.to_numeric(values, errors='coerce')).astype('Int64').array
+	if kind == 'boolean':
+		return pd.Series(values, dtype=object).map({True: True, False: False, 'True': True, 'False': False}).astype('boolean').array
+	if kind == 'category':
+		return pd.Categorical(values)
+	if kind == 'string':
+		return pd.array(values, dtype='string')
+	raise ValueError('Unknown column type ' + kind)
+
+def _convert_column(values, kind: str, label: str):
+	"""Convert raw values with `_convert_values`, warning if any non-blank value became null.
 
-def query_iterate(table_name: str, req_size: int=100000, verbose: bool=True):
+	Parsing is lenient so that one malformed value does not fail the table, but the values
+	lost that way are counted and reported per column (`label`) rather than dropped silently.
 	"""
-	Query the EEA data portal to retrieve the entirety of a data table.
+	converted = _convert_values(values, kind)
+	if kind in ('datetime', 'float', 'Int64', 'boolean'):
+		raw = pd.Series(values, dtype=object)
+		lost = raw.notna().to_numpy() & (raw.astype(str).str.strip() != '').to_numpy() & np.asarray(pd.isna(converted))
+		if lost.any():
+			print('WARNING: ' + label + ': ' + str(int(lost.sum())) + ' values not parseable as ' + kind + ' were set to null (e.g. ' + repr(raw[lost].iloc[0]) + ')')
+	return converted
+
+def decode_page(table_name: str, items: list) -> pd.DataFrame:
+	"""
+	Build a typed DataFrame directly from a page of DataLake JSON records.
 
-	Returns
+	Each column is gathered from the records once and converted straight to its
+	TABLE_SCHEMAS type, rather than building an object-dtype frame and re-parsing later.
+	Columns without a registered type become nullable strings.
 
 	Args:
-		table_name (str): EEA data portal table to query
-		req_size (int): Request chunksize
-		verbose (bool): Print chunk position while iterating
+		table_name (str): EEA data portal table the records came from
+		items (list): The 'Items' list of a DataLake response
 
 	Returns:
-		df: Pandas DataFrame with table contents
+		df: Pandas DataFrame with typed columns
 	"""
-	session = _make_session()
+	schema = TABLE_SCHEMAS.get(table_name, {})
+	columns = dict.fromkeys(key for item in items for key in item)
+	data = {}
+	for col in columns:
+		values = [item.get(col) for item in items]
+		data[col] = _convert_column(values, schema.get(col, 'string'), table_name + '.' + col)
+	return pd.DataFrame(data, columns=list(columns))
 
-	# Get total table size
+def apply_schema(table_name: str, df: pd.DataFrame) -> pd.DataFrame:
+	"""Convert the TABLE_SCHEMAS columns of an already-loaded table (e.g. read from CSV as text)."""
+	for col, kind in TABLE_SCHEMAS.get(table_name, {}).items():
+		if col in df.columns:
+			df[col] = _convert_column(df[col], kind, table_name + '.' + col)
+	return df
+
+def concat_pages(pages) -> pd.DataFrame:
+	"""Concatenate typed pages, unifying categories so categorical columns stay categorical."""
+	pages = list(pages)
+	for col in pages[0].columns:
+		if isinstance(pages[0][col].dtype, pd.CategoricalDtype) and len(pages) > 1:
+			categories = union_categoricals([p[col] for p in pages if col in p.columns], ignore_order=True).categories
+			for p in pages:
+				if col in p.columns:
+					p[col] = p[col].astype(pd.CategoricalDtype(categories))
+	return pd.concat(pages)
+
+def _portal_get(url: str) -> requests.Response:
+	"""GET a portal URL through the HTTP cache on this thread's session, waiting for one of the MAX_PORTAL_REQUESTS slots."""
+	with _portal_slots:
+		return cached_get(url, session=get_session(), ttl=PORTAL_CACHE_TTL, headers=REQ_HEADER)
+
+def _query_window(table_name: str, start: int, end: int, stats: Optional['FetchStats']=None, sizer: Optional['_PageSizer']=None) -> pd.DataFrame:
+	"""Request rows [start, end) of a table and return them as a DataFrame.
+
+	Latency, payload size and the number of transparent retries are reported to `stats`
+	and `sizer` if given.
+	"""
+	url = API_ROOT + table_name + '?_end=' + str(end) + '&_start=' + str(start)
+	t0 = time.monotonic()
+	r = _portal_get(url)
+	seconds = time.monotonic() - t0
+	retries = len(r.raw.retries.history) if getattr(r.raw, 'retries', None) is not None else 0
+	df = decode_page(table_name, r.json()['Items'])
+	if stats is not None:
+		stats.record(len(df), len(r.content), retries, seconds)
+	if sizer is not None:
+		sizer.observe(seconds, retries)
+	return df
+
+def _get_table_size(table_name: str) -> int:
+	"""Return the portal's TotalCount for a table."""
 	try:
-		r = session.get(API_ROOT + table_name + '?_end=1&_start=0', headers=REQ_HEADER)
-		table_size = r.json()['TotalCount']
+		r = _portal_get(API_ROOT + table_name + '?_end=1&_start=0')
+		return r.json()['TotalCount']
 	except ValueError:
 		raise ValueError("EEA Data Portal request returned error " + str(r.status_code) + '; perhaps table name is not valid\n\nFull response message:\n' + r.text)
 
-	# Iterate through requests
-	if (table_size < req_size):
-		req_bins = [0, table_size]
+class FetchStats:
+	"""Throughput telemetry for fetching one table: request count, rows, bytes, retries and time."""
+	def __init__(self, table_name: str):
+		self.table_name = table_name
+		self.requests = 0
+		self.rows = 0
+		self.bytes = 0
+		self.retries = 0
+		self.request_seconds = 0.
+		self.started = time.monotonic()
+		self.finished = None
+		self.lock = threading.Lock()
+
+	def record(self, rows: int, n_bytes: int, retries: int, seconds: float):
+		with self.lock:
+			self.requests += 1
+			self.rows += rows
+			self.bytes += n_bytes
+			self.retries += retries
+			self.request_seconds += seconds
+
+	def finish(self):
+		self.finished = time.monotonic()
+
+	def report(self) -> dict:
+		"""Return a summary row; wall time runs to `finish()` or to now if still fetching."""
+		wall_seconds = (self.finished or time.monotonic()) - self.started
+		return {
+			'table': self.table_name,
+			'requests': self.requests,
+			'rows': self.rows,
+			'bytes': self.bytes,
+			'retries': self.retries,
+			'request_seconds': round(self.request_seconds, 2),
+			'wall_seconds': round(wall_seconds, 2),
+			'rows_per_sec': round(self.rows / wall_seconds, 1) if wall_seconds > 0 else np.nan,
+			'bytes_per_sec': round(self.bytes / wall_seconds, 1) if wall_seconds > 0 else np.nan,
+			}
+
+class _PageSizer:
+	"""Choose the next window size from recent request latency and retries.
+
+	Windows that needed retries (5xx / 429) halve the size; windows that finish in under
+	half of `target_seconds` grow it by half again.  The size stays within [min_size, max_size].
+	"""
+	def __init__(self, req_size: int, min_size: int=MIN_REQ_SIZE, max_size: int=MAX_REQ_SIZE, target_seconds: float=TARGET_REQ_SECONDS):
+		self.min_size = min_size
+		self.max_size = max(max_size, min_size)
+		self.size = int(min(max(req_size, self.min_size), self.max_size))
+		self.target_seconds = target_seconds
+		self.lock = threading.Lock()
+
+	def observe(self, seconds: float, retries: int):
+		with self.lock:
+			if retries > 0 or seconds > self.target_seconds:
+				self.size = max(self.min_size, self.size // 2)
+			elif seconds < self.target_seconds / 2:
+				self.size = min(self.max_size, int(self.size * 1.5))
+
+class _Checkpoint:
+	"""On-disk store of completed windows for one table, indexed by a JSON manifest.
+
+	Windows are keyed by their start offset, so a rerun can reuse them even if it would
+	otherwise have chosen different window sizes.  The manifest records the table size the
+	windows were fetched against and when the checkpoint was created; if the portal reports
+	a different size the saved windows may no longer line up, and if the checkpoint is older
+	than `max_age` seconds its windows may be stale, so in either case they are discarded.
+	"""
+	def __init__(self, table_name: str, table_size: int, checkpoint_dir: str=CHECKPOINT_DIR, max_age: float=CHECKPOINT_MAX_AGE):
+		self.path = os.path.join(checkpoint_dir, table_name)
+		self.manifest_path = os.path.join(self.path, 'manifest.json')
+		self.lock = threading.Lock()
+		self.manifest = {'table': table_name, 'table_size': int(table_size), 'created': time.time(), 'windows': {}}
+		if os.path.exists(self.manifest_path):
+			with open(self.manifest_path) as f:
+				manifest = json.load(f)
+			age = time.time() - manifest.get('created', 0)
+			if manifest.get('table_size') != self.manifest['table_size']:
+				print(table_name + ': discarding checkpoint for table size ' + str(manifest.get('table_size')))
+				shutil.rmtree(self.path)
+			elif age > max_age:
+				print(table_name + ': discarding checkpoint from ' + str(round(age / 3600)) + ' hours ago')
+				shutil.rmtree(self.path)
+			else:
+				self.manifest = manifest
+		os.makedirs(self.path, exist_ok=True)
+
+	def saved_end(self, start: int) -> Optional[int]:
+		"""Return the end offset of a completed window beginning at `start`, or None."""
+		window = self.manifest['windows'].get(str(start))
+		return None if window is None else window['end']
+
+	def get(self, start: int) -> pd.DataFrame:
+		"""Load the completed window beginning at `start`."""
+		return pd.read_pickle(os.path.join(self.path, self.manifest['windows'][str(start)]['file']))
+
+	def put(self, start: int, end: int, df: pd.DataFrame):
+		"""Save a completed window and record it in the manifest."""
+		fn = str(start) + '-' + str(end) + '.p'
+		df.to_pickle(os.path.join(self.path, fn + '.tmp'), compression=None)
+		os.replace(os.path.join(self.path, fn + '.tmp'), os.path.join(self.path, fn))
+		with self.lock:
+			self.manifest['windows'][str(start)] = {'end': int(end), 'file': fn}
+			with open(self.manifest_path + '.tmp', 'w') as f:
+				json.dump(self.manifest, f, indent=1)
+			os.replace(self.manifest_path + '.tmp', self.manifest_path)
+
+	def clear(self):
+		shutil.rmtree(self.path, ignore_errors=True)
+
+def iter_pages(table_name: str, req_size: int=100000, verbose: bool=True, max_workers: int=MAX_WORKERS, start: int=0, table_size: Optional[int]=None, checkpoint_dir: Optional[str]=CHECKPOINT_DIR, adaptive: bool=True, stats: Optional[FetchStats]=None):
+	"""
+	Yield the pages of an EEA data portal table in table order.
+
+	Windows are fetched concurrently, but no more than `max_workers` pages are requested
+	ahead of the consumer, so memory stays bounded by a few pages regardless of table size.
+
+	If `adaptive` is set, `req_size` is only the starting window size: each new window is
+	sized by `_PageSizer` from the latency and retry count of the responses so far.
+
+	If `checkpoint_dir` is set, each completed window is also saved there as it arrives.
+	A rerun after a failure loads those windows from disk and only requests the missing
+	ones; the checkpoint is deleted once every page has been consumed.
+
+	Args:
+		table_name (str): EEA data portal table to query
+		req_size (int): Request chunksize (initial chunksize if `adaptive`)
+		verbose (bool): Print chunk position while iterating
+		max_workers (int): Maximum number of concurrent requests; 1 fetches sequentially
+		start (int): First row offset to fetch
+		table_size (int): Table size if already known; queried from the portal otherwise
+		checkpoint_dir (str): Directory for resumable window checkpoints; None disables them
+		adaptive (bool): Adjust the window size between MIN_REQ_SIZE and MAX_REQ_SIZE
+		stats (FetchStats): Telemetry object to record each request into
+
+	Yields:
+		df: Pandas DataFrame with one window of the table
+	"""
+	if table_size is None:
+		table_size = _get_table_size(table_name)
+	if adaptive:
+		sizer = _PageSizer(req_size, min_size=min(req_size, MIN_REQ_SIZE), max_size=max(req_size, MAX_REQ_SIZE))
 	else:
-		max_bin = table_size + req_size
-		req_bins = np.arange(0, max_bin, req_size)
-	dfs = []
-	for i in range(len(req_bins) - 1):
+		sizer = _PageSizer(req_size, min_size=req_size, max_size=req_size)
+	checkpoint = _Checkpoint(table_name, table_size, checkpoint_dir) if checkpoint_dir else None
+
+	def fetch(window_start: int, window_end: int, saved: bool) -> pd.DataFrame:
 		# Log output
-		if verbose: print(table_name + ': request ' + str(i + 1) + ' of ' + str(len(req_bins) - 1))
-		# Make request
-		url = API_ROOT + table_name + '?_end=' + str(req_bins[i+1]) + '&_start='+str(req_bins[i])
-		r = session.get(url, headers=REQ_HEADER)
-		# Add chunk contents to dataframe list
-		dfs += [pd.DataFrame(r.json()['Items'])]
+		if verbose: print(table_name + ': rows ' + str(window_start) + '-' + str(min(window_end, table_size)) + ' of ' + str(table_size) + (' loaded from checkpoint' if saved else ''))
+		if saved:
+			return checkpoint.get(window_start)
+		df = _query_window(table_name, window_start, window_end, stats=stats, sizer=sizer)
+		if checkpoint is not None:
+			checkpoint.put(window_start, window_end, df)
+		return df
+
+	# Windows are sized as they are submitted, so later windows use the latest size;
+	# futures are consumed first-in first-out, so chunks stay in table order
+	cursor = start
+	with ThreadPoolExecutor(max_workers=max_workers) as executor:
+		pending = deque()
+		while cursor < table_size or (cursor == start and not pending):
+			window_end = checkpoint.saved_end(cursor) if checkpoint is not None else None
+			saved = window_end is not None
+			if not saved:
+				window_end = cursor + sizer.size
+			pending.append(executor.submit(fetch, cursor, window_end, saved))
+			cursor = max(window_end, cursor + 1)
+			if len(pending) >= max_workers:
+				yield pending.popleft().result()
+		while pending:
+			yield pending.popleft().result()
+	if checkpoint is not None:
+		checkpoint.clear()
+
+def query_iterate(table_name: str, req_size: int=100000, verbose: bool=True, max_workers: int=MAX_WORKERS):
+	"""
+	Query the EEA data portal to retrieve the entirety of a data table.
+
+	Windows are fetched concurrently but returned in their original order.
+
+	Args:
+		table_name (str): EEA data portal table to query
+		req_size (int): Request chunksize
+		verbose (bool): Print chunk position while iterating
+		max_workers (int): Maximum number of concurrent requests; 1 fetches sequentially
 
+	Returns:
+		df: Pandas DataFrame with table contents
+	"""
 	# Concatenate chunks
-	df = pd.concat(dfs)
+	df = concat_pages(iter_pages(table_name, req_size=req_size, verbose=verbose, max_workers=max_workers))
 
 	return df
 
-def main():
-	"""Query for data, persist it, and report the update
+class RowSampler:
+	"""Keep a uniform random sample of `n` rows from a stream of pages.
+
+	Each row gets a random key and the `n` rows with the smallest keys are retained, which
+	is equivalent to `df.sample(n)` over the concatenated stream.
+	"""
+	def __init__(self, n: int=10):
+		self.n = n
+		self.rng = np.random.default_rng()
+		self.sample = None
+		self.keys = np.array([])
+
+	def update(self, page: pd.DataFrame):
+		keys = np.concatenate([self.keys, self.rng.random(len(page))])
+		rows = page if self.sample is None else pd.concat([self.sample, page])
+		keep = np.argsort(keys)[:self.n]
+		self.sample = rows.iloc[keep]
+		self.keys = keys[keep]
+
+	def result(self) -> pd.DataFrame:
+		return self.sample
+
+def _add_year(page: pd.DataFrame, date_col: str) -> pd.DataFrame:
+	"""Return the page with a 'Year' column derived from `date_col`, if it lacks one."""
+	if 'Year' in page.columns:
+		return page
+	return add_date_parts(page, date_col, parts=('Year',))
+
+class GroupCountAggregator:
+	"""Running count of non-null `value_col` values per group across pages.
+
+	Equivalent to `df.groupby(keys).agg({value_col: pd.Series.count})` on the full table,
+	but only one page is grouped at a time.  A 'Year' key is derived from `date_col`.
+	"""
+	def __init__(self, keys: tuple, value_col: str='Result', date_col: str='CollectedDate'):
+		self.keys = list(keys)
+		self.value_col = value_col
+		self.date_col = date_col
+		self.counts = None
+
+	def update(self, page: pd.DataFrame):
+		if 'Year' in self.keys:
+			page = _add_year(page, self.date_col)
+		## Group on plain labels; categorical keys from different pages would not align
+		page_counts = page.groupby([page[c].astype(object) for c in self.keys])[self.value_col].count()
+		self.counts = page_counts if self.counts is None else self.counts.add(page_counts, fill_value=0)
+
+	def result(self) -> pd.DataFrame:
+		df = self.counts.astype(int).to_frame(self.value_col)
+		if 'Year' in self.keys:
+			level = self.keys.index('Year')
+			df.index = df.index.set_levels(df.index.levels[level].astype(int), level=level)
+		return df.sort_index()
+
+class LatestRecordAggregator:
+	"""Keep the most recent record per group across pages.
+
+	Keeps the last whole row per group after sorting by `date_col`, so all of `cols` come
+	from the same record.  This differs from `groupby(keys).last()`, which takes the last
+	non-null value of each column separately.  Rows with a null key or date are dropped,
+	as groupby would drop them.  Only the current latest row per group is held between pages.
+	"""
+	def __init__(self, keys: tuple, cols: tuple, date_col: str='CollectedDate'):
+		self.keys = list(keys)
+		self.cols = [c for c in cols if c not in keys and c != date_col]
+		self.date_col = date_col
+		self.latest = None
+
+	def update(self, page: pd.DataFrame):
+		rows = page[self.keys + [self.date_col] + self.cols].astype({c: object for c in self.keys})
+		rows = rows.assign(**{self.date_col: parse_dates(rows[self.date_col])}).dropna(subset=self.keys + [self.date_col])
+		if self.latest is not None:
+			rows = pd.concat([self.latest, rows])
+		## Stable sort so that among equal dates the later page wins, as with sort + last()
+		self.latest = rows.sort_values(self.date_col, kind='stable').drop_duplicates(self.keys, keep='last')
+
+	def result(self) -> pd.DataFrame:
+		return self.latest.set_index(self.keys).sort_index()
+
+class SummaryAggregator:
+	"""Compute several drinkingWater summaries (DW_SUMMARIES) in a single pass over the pages.
+
+	Shared derived columns (Year) are added once per page before it is handed to each
+	summary's aggregator.
+	"""
+	def __init__(self, summaries: dict=None, date_col: str='CollectedDate'):
+		self.summaries = DW_SUMMARIES if summaries is None else summaries
+		self.date_col = date_col
+		self.aggregators = {}
+		for name, spec in self.summaries.items():
+			if spec['type'] == 'count':
+				self.aggregators[name] = GroupCountAggregator(spec['keys'], value_col=spec.get('value_col', 'Result'), date_col=date_col)
+			elif spec['type'] == 'latest':
+				self.aggregators[name] = LatestRecordAggregator(spec['keys'], spec['cols'], date_col=date_col)
+			else:
+				raise ValueError('Unknown summary type ' + spec['type'] + ' for ' + name)
+
+	def update(self, page: pd.DataFrame):
+		page = _add_year(page, self.date_col)
+		for aggregator in self.aggregators.values():
+			aggregator.update(page)
+
+	def result(self) -> dict:
+		return {name: aggregator.result() for name, aggregator in self.aggregators.items()}
+
+class _CsvPageWriter:
+	"""Append DataFrame pages to one CSV file, writing the header with the first page."""
+	def __init__(self, path: str):
+		self.path = path
+		self.started = False
+
+	def write(self, page: pd.DataFrame):
+		page.to_csv(self.path, mode='a' if self.started else 'w', header=not self.started, encoding='utf-8', index=0, date_format=DATE_FORMAT)
+		self.started = True
+
+	def close(self):
+		pass
+
+class _ParquetPageWriter:
+	"""Append DataFrame pages to one Parquet file with the schema fixed by the first page.
+
+	Categoricals are stored as dictionary<int32, string> so each page may carry its own
+	categories, and untyped object columns are stored as strings so a column that happens
+	to look numeric in the first page still accepts text later.
+	"""
+	def __init__(self, path: str):
+		self.path = path
+		self.schema = None
+		self.writer = None
+
+	def write(self, page: pd.DataFrame):
+		import pyarrow as pa
+		import pyarrow.parquet as pq
+		page = page.astype({c: 'string' for c in page.columns if page[c].dtype == object})
+		if self.schema is None:
+			schema = pa.Schema.from_pandas(page, preserve_index=False)
+			for i, field in enumerate(schema):
+				if pa.types.is_dictionary(field.type):
+					schema = schema.set(i, field.with_type(pa.dictionary(pa.int32(), pa.string())))
+				elif pa.types.is_null(field.type):
+					schema = schema.set(i, field.with_type(pa.string()))
+			self.schema = schema
+			self.writer = pq.ParquetWriter(self.path, self.schema)
+		self.writer.write_table(pa.Table.from_pandas(page, schema=self.schema, preserve_index=False))
+
+	def close(self):
+		if self.writer is not None:
+			self.writer.close()
+
+def _write_pages(pages, out_paths, aggregators: tuple=()) -> int:
+	"""Write an iterable of DataFrame pages to each of `out_paths`, feeding each page to the aggregators.
+
+	Paths ending in '.parquet' are written as Parquet, anything else as CSV.
+	"""
+	if isinstance(out_paths, str):
+		out_paths = [out_paths]
+	writers = [_ParquetPageWriter(p) if p.endswith('.parquet') else _CsvPageWriter(p) for p in out_paths]
+	columns = None
+	n_rows = 0
+	try:
+		for page in pages:
+			if columns is None:
+				columns = list(page.columns)
+			page = page.reindex(columns=columns)
+			for writer in writers:
+				writer.write(page)
+			for aggregator in aggregators:
+				aggregator.update(page)
+			n_rows += len(page)
+	finally:
+		for writer in writers:
+			writer.close()
+	return n_rows
+
+class _MaxValue:
+	"""Track the latest date in one column across pages."""
+	def __init__(self, col: Optional[str]):
+		self.col = col
+		self.value = pd.NaT
+
+	def update(self, page: pd.DataFrame):
+		if self.col is None or self.col not in page.columns:
+			return
+		page_max = parse_dates(page[self.col]).max()
+		if pd.notna(page_max) and (pd.isna(self.value) or page_max > self.value):
+			self.value = page_max
+
+	def result(self) -> Optional[str]:
+		return None if pd.isna(self.value) else self.value.strftime(DATE_FORMAT)
+
+def _load_sync_state() -> dict:
+	if not os.path.exists(SYNC_STATE_FILE):
+		return {}
+	with open(SYNC_STATE_FILE) as f:
+		return json.load(f)
+
+def _save_sync_state(state: dict):
+	with open(SYNC_STATE_FILE, 'w') as f:
+		json.dump(state, f, indent=1, sort_keys=True)
+
+def _iter_snapshot(path: str, chunksize: int):
+	"""Yield a local snapshot in chunks, keeping CSV cells as text so they are rewritten unchanged."""
+	if path.endswith('.parquet'):
+		import pyarrow.parquet as pq
+		for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+			yield batch.to_pandas()
+	else:
+		yield from pd.read_csv(path, chunksize=chunksize, dtype=str, keep_default_na=False, na_values=[''])
+
+def _read_snapshot_ids(path: str) -> pd.Series:
+	if path.endswith('.parquet'):
+		return pd.read_parquet(path, columns=['Id'])['Id'].astype(str)
+	return pd.read_csv(path, usecols=['Id'], dtype=str)['Id']
+
+def _with_date_parts(table_name: str, pages):
+	"""Add Year, Month and FiscalYear columns from the table's TABLE_DATE_COLS date to each page."""
+	date_col = TABLE_DATE_COLS.get(table_name)
+	for page in pages:
+		yield page if date_col is None or date_col not in page.columns else add_date_parts(page, date_col)
+
+def _tmp_path(path: str) -> str:
+	root, ext = os.path.splitext(path)
+	return root + '.tmp' + ext
+
+def _replace_pages(pages, out_paths: list, aggregators: tuple=()) -> int:
+	"""Write pages to temporary files and move them over `out_paths` only once all are written.
+
+	A failure partway through leaves the previous outputs in place rather than truncated ones.
+	"""
+	tmp_paths = [_tmp_path(p) for p in out_paths]
+	try:
+		n_rows = _write_pages(pages, tmp_paths, aggregators)
+	except BaseException:
+		for tmp_path in tmp_paths:
+			if os.path.exists(tmp_path):
+				os.remove(tmp_path)
+		raise
+	for tmp_path, path in zip(tmp_paths, out_paths):
+		os.replace(tmp_path, path)
+	return n_rows
+
+def sync_table(table_name: str, out_path: str, aggregators: tuple=(), req_size: int=100000, full_refresh: bool=False, parquet: bool=False, **query_kws) -> int:
+	"""
+	Bring a local snapshot of an EEA data portal table up to date, fetching only the tail.
+
+	The previous run's row count, column list and maximum date (TABLE_DATE_COLS) are kept
+	in SYNC_STATE_FILE.  If the table has grown and its columns are unchanged, only windows
+	from one `req_size` before the previous row count onward are requested; the overlap
+	picks up late edits to recent records.  Fetched rows replace snapshot rows with the
+	same `Id` and the snapshot is rewritten page by page, with Year, Month and FiscalYear
+	columns derived from the table's date column.  A full refresh is done instead
+	when there is no state or snapshot, when the count shrinks or the columns change, or
+	when the merged row count does not match the portal's count.
+
+	Args:
+		table_name (str): EEA data portal table to query
+		out_path (str): Snapshot path (CSV, or Parquet if it ends in '.parquet')
+		aggregators (tuple): Objects with an `update(page)` method fed every output page
+		req_size (int): Request chunksize
+		full_refresh (bool): Re-download the whole table regardless of the saved state
+		parquet (bool): Also write a typed Parquet copy next to `out_path`
+		query_kws: Passed through to `iter_pages`
+
+	Returns:
+		n_rows: Number of rows in the updated snapshot
+	"""
+	out_paths = [out_path]
+	if parquet and not out_path.endswith('.parquet'):
+		out_paths.append(os.path.splitext(out_path)[0] + '.parquet')
+	with _sync_state_lock:
+		prev = _load_sync_state().get(table_name)
+	table_size = _get_table_size(table_name)
+	columns = list(_query_window(table_name, 0, 1).columns)
+	high_water = _MaxValue(TABLE_DATE_COLS.get(table_name))
+	aggregators = tuple(aggregators) + (high_water,)
+
+	if full_refresh:
+		reason = 'requested'
+	elif prev is None or not os.path.exists(out_path):
+		reason = 'no local snapshot'
+	elif table_size < prev['count']:
+		reason = 'row count decreased from ' + str(prev['count']) + ' to ' + str(table_size)
+	elif columns != prev['columns']:
+		reason = 'columns changed'
+	else:
+		reason = None
+
+	n_rows = None
+	if reason is None:
+		start = max(0, prev['count'] - req_size)
+		delta = concat_pages(iter_pages(table_name, req_size=req_size, start=start, table_size=table_size, **query_kws))
+		delta_ids = delta['Id'].astype(str)
+		n_kept = int((~_read_snapshot_ids(out_path).isin(delta_ids)).sum())
+		if n_kept + len(delta) != table_size:
+			reason = 'merged count ' + str(n_kept + len(delta)) + ' does not match portal count ' + str(table_size)
+		else:
+			print(table_name + ': incremental sync of ' + str(len(delta)) + ' rows from offset ' + str(start))
+			def merged_pages():
+				for chunk in _iter_snapshot(out_path, req_size):
+					yield apply_schema(table_name, chunk[~chunk['Id'].astype(str).isin(delta_ids)].reindex(columns=columns))
+				yield delta
+			n_rows = _replace_pages(_with_date_parts(table_name, merged_pages()), out_paths, aggregators)
+
+	if n_rows is None:
+		print(table_name + ': full refresh (' + reason + ')')
+		n_rows = _replace_pages(_with_date_parts(table_name, iter_pages(table_name, req_size=req_size, table_size=table_size, **query_kws)), out_paths, aggregators)
+
+	max_date = high_water.result()
+	print(table_name + ': ' + str(n_rows) + ' rows, latest ' + str(TABLE_DATE_COLS.get(table_name)) + ' ' + str(max_date))
+	## Re-read under the lock; other tables may have been synced in parallel
+	with _sync_state_lock:
+		state = _load_sync_state()
+		state[table_name] = {
+			'count': n_rows,
+			'columns': columns,
+			'max_date': max_date,
+			'updated': str(datetime.datetime.now()).split('.')[0],
+			}
+		_save_sync_state(state)
+	return n_rows
+
+def pull_gcs_snapshot(fn: str):
+	"""Download a snapshot that is only kept on GCS (drinkingWater) if there is no local copy.
+
+	CI starts from a fresh checkout, so without this the incremental sync of the table
+	would always fall back to a full refresh.  If the download fails, `sync_table` finds no
+	snapshot and does a full refresh as before.
 	"""
-	# Get data
-	## Query data for each table
-	table_data = {}
-	for tab in API_TABLES:
-		table_data[tab] = query_iterate(tab)
+	if os.path.exists(fn):
+		return
+	print('Downloading ' + fn + ' snapshot from GCS')
+	if os.system('gsutil -q cp gs://openamend-data/' + fn + ' ' + _tmp_path(fn)) == 0:
+		os.replace(_tmp_path(fn), fn)
+	elif os.path.exists(_tmp_path(fn)):
+		os.remove(_tmp_path(fn))
+
+def run_table(tab: str, incremental: bool=True) -> dict:
+	"""Fetch, write, sample and (for drinkingWater) upload and summarize one table.
+
+	Args:
+		tab (str): EEA data portal table name
+		incremental (bool): Passed to `sync_table` as `full_refresh=not incremental`
 
+	Returns:
+		report: `FetchStats.report()` for the table
+	"""
 	## Write out, but treat large tables separately
 	## Only one table (drinkingWater) is >10MB as of 08/2017, so we handle this as a special case.
 	## Could also use `size_MB = os.path.getsize('../docs/data/EEADP_' + tab + '.csv')/1024/1024` to get file size
-	for tab in API_TABLES:
+	stats = FetchStats(tab)
+	## Stream pages straight to disk so the full table is never held in memory
+	sampler = RowSampler(n=10)
+	if tab != 'drinkingWater':
+		sync_table(tab, data_path('EEADP_' + tab + '.csv'), aggregators=[sampler], full_refresh=not incremental, parquet=WRITE_PARQUET, stats=stats)
 		## Print a sample of the file as an example
-		table_data[tab].sample(n=10).to_csv('../docs/data/EEADP_' + tab + '_sample.csv', index=0)
-		
-		if tab != 'drinkingWater': 
-			table_data[tab].to_csv('../docs/data/EEADP_' + tab + '.csv', index=0)
-		else:
-			## Send to Google object store
-			table_data[tab].to_csv('EEADP_' + tab + '.csv', encoding='utf-8', index=0)
-			os.system('gsutil cp EEADP_' + tab + '.csv gs://openamend-data/EEADP_' + tab + '.csv')
-			
-			## Include some special summary statistics tables
-			## ---		
-			## Most recent report for each chemical for each site
-			## This still ends up being ~20% of the original size, so larger than desired
-			#table_data[tab].sort_values('CollectedDate', inplace=True)
-			#df_dw_last = table_data[tab].groupby(['ChemicalName','PWSName','LocationName']).last()
-			
-			# Tests per year per PWS per contaminant group per raw/finished
-			## This still ends up being ~40% of the original size, so larger than desired
-			table_data[tab]['CollectedDate'] = pd.to_datetime(table_data[tab]['CollectedDate'], errors='coerce')
-			table_data[tab]['Year'] = table_data[tab]['CollectedDate'].apply(lambda x: x.year)
-			df_dw_annual_group = table_data[tab].groupby(['Year','PWSName', 'ContaminantGroup','RaworFinished']).agg({'Result': pd.Series.count})
-			df_dw_annual_group.to_csv('../docs/data/EEADP_' + tab + '_annual.csv', index=1)
+		sampler.result().to_csv(data_path('EEADP_' + tab + '_sample.csv'), index=0)
+	else:
+		## All summary tables are built in the same pass that writes the table
+		summaries = SummaryAggregator()
+		if incremental:
+			pull_gcs_snapshot('EEADP_' + tab + '.csv')
+		sync_table(tab, 'EEADP_' + tab + '.csv', aggregators=[sampler, summaries], full_refresh=not incremental, parquet=WRITE_PARQUET, stats=stats)
+		## Print a sample of the file as an example
+		sampler.result().to_csv(data_path('EEADP_' + tab + '_sample.csv'), index=0)
+
+		## Send to Google object store
+		os.system('gsutil cp EEADP_' + tab + '.csv gs://openamend-data/EEADP_' + tab + '.csv')
+		if WRITE_PARQUET:
+			os.system('gsutil cp EEADP_' + tab + '.parquet gs://openamend-data/EEADP_' + tab + '.parquet')
+
+		## Include some special summary statistics tables
+		## ---
+		for name, df_summary in summaries.result().items():
+			summary_fn = 'EEADP_' + tab + '_' + name + '.csv'
+			if DW_SUMMARIES[name].get('gcs'):
+				df_summary.to_csv(summary_fn, index=1, date_format=DATE_FORMAT)
+				os.system('gsutil cp ' + summary_fn + ' gs://openamend-data/' + summary_fn)
+			else:
+				df_summary.to_csv(data_path(summary_fn), index=1, date_format=DATE_FORMAT)
 			## Print a sample of the file as an example
-			df_dw_annual_group.sample(n=10).to_csv('../docs/data/EEADP_' + tab + '_annual_sample.csv', index=1)
+			df_summary.sample(n=min(10, len(df_summary))).to_csv(data_path(summary_fn.replace('.csv', '_sample.csv')), index=1, date_format=DATE_FORMAT)
+
+	stats.finish()
+	return stats.report()
+
+def main(incremental: bool=True):
+	"""Query for data, persist it, and report the update
+
+	Each table runs as an independent pipeline (`run_table`) in parallel, with portal
+	requests across all tables capped at MAX_PORTAL_REQUESTS.  A table that fails does not
+	stop the others; failures are reported together at the end and the run exits with an
+	error without bumping the update timestamp.
+
+	Args:
+		incremental (bool): Only fetch the tail of each table since the last run (see
+			`sync_table`); False re-downloads every table from offset 0
+	"""
+	fetch_reports = []
+	failures = {}
+	with ThreadPoolExecutor(max_workers=MAX_TABLE_WORKERS) as executor:
+		futures = {tab: executor.submit(run_table, tab, incremental) for tab in API_TABLES}
+		for tab, future in futures.items():
+			try:
+				fetch_reports.append(future.result())
+			except Exception as e:
+				print(tab + ': FAILED: ' + repr(e))
+				failures[tab] = e
+
+	## Report fetch throughput per table
+	df_report = pd.DataFrame(fetch_reports)
+	print(df_report.to_string(index=False))
+	df_report.to_csv(FETCH_REPORT_FILE, index=0)
 
-			## Tests per year per PWS per chemical per raw/finished
-			### This still ends up being ~40% of the original size, so larger than desired
-			#df_dw_annual = table_data[tab].groupby(['Year','PWSName', 'ChemicalName','RaworFinished']).agg({'ContaminantGroup': lambda x: x.iloc[0], 'Result': pd.Series.count})
+	if failures:
+		raise RuntimeError('EEA Data Portal fetch failed for tables: ' + ', '.join(failures)) from next(iter(failures.values()))
 
 	# Archive PDF help files
 	os.system('wget http://eeaonline.eea.state.ma.us/Portal/documents/General%20Query%20Search%20FAQs.pdf')
@@ -150,7 +934,7 @@ def main():
 	os.system('mv "Terms and Definitions for EEA.pdf" ../docs/assets/PDFs/EEADP_Definitions.pdf')
 
 	# Report last update
-	with open('../docs/data/ts_update_EEADP.yml', 'w') as f:
+	with open(data_path('ts_update_EEADP.yml'), 'w') as f:
 		f.write('updated: '+str(datetime.datetime.now()).split('.')[0]+'\n')
 
 if __name__ == '__main__':
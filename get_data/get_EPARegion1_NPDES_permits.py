@@ -8,32 +8,51 @@ Key known EPA page changes that have been worked around:
   - ~2025: JSON payload switched from orient='split' to {"data": [...]}
   - ~2025: Column renamed from 'Facility Name' to 'Applicant / Facility Name'
 
-PDF sync is incremental: a single `gsutil ls` call lists what is already in GCS and
-only newly-discovered PDFs are downloaded and uploaded.  This makes both local runs
-and GitHub Actions runs efficient.
+The 12 listing pages, and the JSON tables they load, are fetched concurrently on pooled,
+retrying sessions and parsed as each one arrives.  Requests go through the shared HTTP
+cache (http_cache.py), so reruns revalidate them instead of downloading them again.
 
-Outputs:
+PDF sync is incremental and driven by a manifest committed next to the permit table,
+recording each PDF URL's ETag/Last-Modified, size, sha256 and storage key.  Known PDFs
+are requested conditionally, so unchanged ones cost a 304 and re-issued ones under the
+same name are picked up.  PDFs are stored by content hash, so a file linked from several
+rows (e.g. both the draft and final listings) is stored once.  Downloads run concurrently
+in-process and are uploaded in batches (see pdf_sync.py).  The bucket is only listed
+when there is no manifest yet, to adopt PDFs stored under the earlier per-permit layout
+(PERMIT_DIR) with HEAD requests rather than downloading them again.
+
+Outputs (tables in ../docs/data, or AMEND_OUTPUT_DIR if set):
   ../docs/data/EPARegion1_NPDES_permit_data.csv  — permit metadata table
+  ../docs/data/EPARegion1_NPDES_permit_pdfs.csv  — PDF manifest (URL, validators, sha256, storage key)
   gs://openamend-data/EPA_Region1_NPDES_permits/ — permit PDFs
   ../docs/data/ts_update_EPARegion1_NPDES_permit.yml — timestamp of last run
 """
 
 from io import StringIO
-from bs4 import BeautifulSoup
-from urllib import request
-import pickle
+import lxml.html
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional
 import pandas as pd
 from unidecode import unidecode,unidecode_expect_nonascii
 import os
 import datetime
 import numpy as np
 
+from http_cache import cached_get, get_session
+from pdf_sync import GCSBackend, LocalBackend, SyncJob, probe_files, sync_files
+from table_io import data_path
+
 # ------------------------------
 # Constants
 # ------------------------------
 
-PERMIT_DIR = 'EPA_Region1_NPDES_permits/{}/{}/{}_'
-GS_URL = 'https://storage.googleapis.com/openamend-data/EPA_Region1_NPDES_permits/{}/{}/{}_'
+PDF_STORE_DIR = 'EPA_Region1_NPDES_permits'
+# Per-permit layout PDFs were stored under before the manifest was introduced
+PERMIT_DIR = PDF_STORE_DIR + '/{}/{}/{}_'
+
+PDF_MANIFEST = data_path('EPARegion1_NPDES_permit_pdfs.csv')
+MANIFEST_COLUMNS = ['url', 'etag', 'last_modified', 'size', 'sha256', 'key', 'checked']
 
 ALL_STATES = {'ct':'connecticut','me':'maine','nh':'new-hampshire','ma':'massachusetts','ri':'rhode-island','vt':'vermont'}
  
@@ -41,207 +60,277 @@ PERMIT_URL_DICT = {}
 PERMIT_URL_DICT['final'] = "https://www.epa.gov/npdes-permits/{}-final-individual-npdes-permits"
 PERMIT_URL_DICT['draft'] = "https://www.epa.gov/npdes-permits/{}-draft-individual-npdes-permits"
 
+# Listing pages are revalidated through the shared HTTP cache on every run
+CACHE_TTL = 0
+
+# Permit PDFs are stored here; set AMEND_PDF_STORE to a local directory to sync there instead
+PDF_BUCKET = 'gs://openamend-data'
+
+# One worker per state/stage listing page
+MAX_WORKERS = len(ALL_STATES) * len(PERMIT_URL_DICT)
+
+# ------------------------------
+# Download helpers
+# ------------------------------
+
+def fetch(url: str) -> bytes:
+    """Return the body of `url`, served from the HTTP cache if it has not changed."""
+    r = cached_get(url, session=get_session(), ttl=CACHE_TTL)
+    r.raise_for_status()
+    return r.content
+
+def json_table_url(content: str, page_url: str, state: str, stage: str) -> Optional[str]:
+    """Return the URL of the JSON table an ajax listing page loads, or None for a static HTML table."""
+    if "'ajax': jsonURL" not in content:
+        return None
+    if "jsonURL = '" not in content:
+        raise ValueError(f"Expected 'jsonURL' JS variable not found in page for {state}/{stage}. EPA page structure may have changed.")
+    jsonfn = content.split("jsonURL = '")[1].split("';")[0].split("?\'")[0].lstrip('/')
+    return '/'.join(page_url.split('/')[:-2]) + '/' + jsonfn
+
+def fetch_listing(page_url: str, state: str, stage: str) -> tuple:
+    """Fetch a listing page and, if it loads one, its JSON table.
+
+    Returns:
+        (content, json_raw): The page as text and the JSON table bytes, or None for an HTML table
+    """
+    content = fetch(page_url).decode('utf-8')
+    json_url = json_table_url(content, page_url, state, stage)
+    return content, (fetch(json_url) if json_url is not None else None)
+
+def storage_backend():
+    """Return the backend permit PDFs are synced to."""
+    if os.environ.get('AMEND_PDF_STORE'):
+        return LocalBackend(os.environ['AMEND_PDF_STORE'])
+    return GCSBackend(PDF_BUCKET)
+
+def content_key(job: SyncJob) -> str:
+    """Return the content-addressed storage key for a downloaded PDF."""
+    return f'{PDF_STORE_DIR}/sha256/{job.sha256[:2]}/{job.sha256}.pdf'
+
+def is_pdf_link(url: str) -> bool:
+    """True for direct PDF links (not HTML listing pages, anchor fragments, etc.)."""
+    return url.lower().split('?')[0].split('#')[0].endswith('.pdf')
+
+def load_manifest(path: str=PDF_MANIFEST) -> dict:
+    """Return the PDF manifest as a dict of records keyed by URL; empty if there is none."""
+    if not os.path.exists(path):
+        return {}
+    manifest = pd.read_csv(path, dtype=str, keep_default_na=False)
+    return {rec['url']: rec for rec in manifest.to_dict('records')}
+
+def save_manifest(manifest: dict, path: str=PDF_MANIFEST):
+    records = [manifest[url] for url in sorted(manifest)]
+    pd.DataFrame(records, columns=MANIFEST_COLUMNS).to_csv(path, index=0, encoding='ascii')
+
+def manifest_record(job: SyncJob) -> dict:
+    return {
+        'url': job.url,
+        'etag': job.etag or '',
+        'last_modified': job.last_modified or '',
+        'size': '' if job.size is None else str(job.size),
+        'sha256': job.sha256 or '',
+        'key': job.key,
+        'checked': str(datetime.datetime.now()).split('.')[0],
+    }
+
+# ------------------------------
+# Parsers
+# ------------------------------
+
+def parse_html_cell(cell: str) -> tuple:
+    """Return the text and the link targets of an HTML table cell, parsing it once."""
+    try:
+        doc = lxml.html.document_fromstring(cell)
+    except lxml.etree.ParserError:
+        ## Empty or whitespace-only cell
+        return '', []
+    return doc.text_content(), [a.get('href') for a in doc.iter('a')]
+
+def parse_json_table(json_raw: bytes, state: str, stage: str) -> list:
+    """Return the permit records from an ajax/json listing table."""
+    ## Decode content
+    jsoncontent = unidecode_expect_nonascii(json_raw.decode('utf-8'))
+
+    ## Convert to dataframe
+    ## EPA changed JSON format from orient='split' to {"data": [...]} around 2025
+    raw = json.loads(jsoncontent)
+    if isinstance(raw, dict) and 'data' in raw:
+        pdf = pd.DataFrame(raw['data'])
+    else:
+        pdf = pd.read_json(StringIO(jsoncontent), orient='split')
+
+    ## Clean up dataframe content
+    city_col_matches = pdf.columns[pdf.columns.str.startswith('City / Town')]
+    if len(city_col_matches) == 0:
+        raise ValueError(f"Expected 'City / Town' column not found in JSON table for {state}/{stage}. Columns: {list(pdf.columns)}")
+    city_col_name = city_col_matches.values[0]
+    pdf['City/Town'] = pdf[city_col_name].str.split(' (', n=1, regex=False).str[0].str.strip()
+    ## EPA renamed 'Facility Name' to 'Applicant / Facility Name' around 2025
+    facility_col = 'Facility Name' if 'Facility Name' in pdf.columns else 'Applicant / Facility Name'
+    if facility_col not in pdf.columns:
+        raise ValueError(f"Expected facility name column not found for {state}/{stage}. Columns: {list(pdf.columns)}")
+    pdf['Facility Name'] = pdf[facility_col]
+    ## Parse each facility cell's HTML once for both its text and its links
+    cells = [parse_html_cell(x) for x in pdf['Facility Name']]
+    pdf['Facility_name_clean'] = [text.split(' (PDF')[0].split('\n')[0].split("in new window.'>")[-1] for text, _ in cells]
+    pdf['Permit_URL'] = [hrefs for _, hrefs in cells]
+    pdf['Stage'] = stage
+    pdf['State'] = state
+    city_parts = pdf[city_col_name].str.split('(', regex=False)
+    pdf['Watershed'] = city_parts.str[1].str[:-1].str.strip().where(city_parts.str.len() > 1, np.nan)
+
+    ## Add to list readout
+    return pdf.to_dict('records')
+
+def parse_html_table(content: str, state: str, stage: str) -> list:
+    """Return the permit records from a static HTML listing table.
+
+    The page is parsed once with lxml and the table's cell text collected into columns;
+    the derived fields are then computed with vectorized string operations.
+    """
+    doc = lxml.html.document_fromstring(content)
+    table = doc.xpath('//tr')
+    header = [th.text_content() for th in table[0].xpath('.//th')]
+
+    print(f'Iterating over N={len(table[1:])} rows')
+    values = {col: [] for col in header}
+    facility_links = []
+    n_rows = 0
+    for row in table[1:]:
+        ## Skip repeated header rows
+        if 'Facility Name' in row.text_content():
+            continue
+        cells = row.xpath('.//td') or row.xpath('.//th')
+        if len(cells) == 0:
+            raise ValueError('Missing expected HTML elements in table')
+        n_rows += 1
+        for i, col in enumerate(header):
+            values[col].append(cells[i].text_content())
+        if 'Facility Name' in values:
+            facility_links.append([a.get('href') for a in cells[header.index('Facility Name')].iter('a')])
+    if n_rows == 0:
+        return []
+
+    def contains(s, pat):
+        return s.str.contains(pat, regex=False, na=False)
+
+    ## Columns are added in the order the fields were first set in each record before
+    out = {'Stage': stage, 'State': state}
+    for col in header:
+        v = pd.Series([unidecode(x) for x in values[col]], dtype=object)
+        v = v.mask(v == 'N/A')
+        out[col] = v
+
+        if stage == 'draft':
+            out.setdefault('Watershed', np.nan)
+            if col == 'Comment Period Dates':
+                has_dates = contains(v, '-')
+                out['Comment_date_start'] = v.str.split('-').str[0].str.strip().where(has_dates)
+                out['Comment_date_end'] = v.str.split('-').str[1].str.split(' (', regex=False).str[0].str.strip().where(has_dates)
+                extended = contains(v, 'Extended') | contains(v, 'Re-opening')
+                out['Comment_date_extension'] = v.str.split().str[-1].str[:-1].where(has_dates & extended)
+
+        if stage == 'final':
+            if 'Watershed' in col:
+                parts = v.str.split('(', regex=False)
+                out['Watershed'] = parts.str[1].str[:-1].str.strip().where(parts.str.len() > 1)
+                out['City/Town'] = v.str.split(' (', regex=False).str[0].str.strip()
+            if 'Issuance' in col:
+                out['Date of Issuance'] = v
+
+        if col == 'Facility Name':
+            out['Facility_name_clean'] = v.str.split(' (PDF', regex=False).str[0].str.split('\n', regex=False).str[0]
+            out['Permit_URL'] = [
+                ['https://www3.epa.gov/region1/npdes/' + href for href in links] if has_pdf else np.nan
+                for links, has_pdf in zip(facility_links, contains(v, '(PDF'))
+            ]
+
+    return pd.DataFrame(out, index=range(n_rows)).to_dict('records')
+
 if __name__ == '__main__':
     # ------------------------------
     # Download files
     # ------------------------------
 
-    all_urls = []
-    all_url_stages = []
-    all_url_states = []
-
-    for state in ALL_STATES:
-        for stage in PERMIT_URL_DICT:
-            all_urls += [PERMIT_URL_DICT[stage].format(ALL_STATES[state])]
-            all_url_states += [state]
-            all_url_stages += [stage]
-
-    opener = request.build_opener()  
-    all_content = [opener.open(request.Request(all_urls[i])).read() for i in range(len(all_urls))]
-    with open('EPARegion1_NPDES_permit_pages.p', 'wb') as f: 
-        pickle.dump(all_content, f)
-
-    permit_data = []
-    for ci, content in enumerate(all_content):
-        
-        # Convert from bytes to string
-        content = content.decode('utf-8')
-        
-        stage = all_url_stages[ci]
-        state = all_url_states[ci]
-        print(f'Downloading stage={stage}, state={state}')
-            
-        ## ajax/json table
-        if "'ajax': jsonURL" in content:
-            print('Parsing json table')
-
-            ## Construct URL
-            if "jsonURL = '" not in content:
-                raise ValueError(f"Expected 'jsonURL' JS variable not found in page for {state}/{stage}. EPA page structure may have changed.")
-            jsonfn = content.split("jsonURL = '")[1].split("';")[0].split("?\'")[0].lstrip('/')
-            jsonURL = '/'.join(all_urls[ci].split('/')[:-2]) + '/' + jsonfn
-
-            ## Request content
-            json_raw = opener.open(request.Request(jsonURL)).read()
-
-            ## Decode content
-            jsoncontent = unidecode_expect_nonascii(json_raw.decode('utf-8'))
-
-            ## Convert to dataframe
-            ## EPA changed JSON format from orient='split' to {"data": [...]} around 2025
-            import json as _json
-            raw = _json.loads(jsoncontent)
-            if isinstance(raw, dict) and 'data' in raw:
-                pdf = pd.DataFrame(raw['data'])
+    ## Fetch all state/stage listings at once and parse each as it arrives;
+    ## results are assembled in state/stage order afterwards
+    pages = [(state, stage, PERMIT_URL_DICT[stage].format(ALL_STATES[state])) for state in ALL_STATES for stage in PERMIT_URL_DICT]
+    page_data = {}
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {executor.submit(fetch_listing, url, state, stage): (state, stage) for state, stage, url in pages}
+        for future in as_completed(futures):
+            state, stage = futures[future]
+            content, json_raw = future.result()
+            print(f'Downloaded stage={stage}, state={state}')
+            if json_raw is not None:
+                print('Parsing json table')
+                page_data[state, stage] = parse_json_table(json_raw, state, stage)
             else:
-                pdf = pd.read_json(StringIO(jsoncontent), orient='split')
-
-            ## Clean up dataframe content
-            city_col_matches = pdf.columns[pdf.columns.str.startswith('City / Town')]
-            if len(city_col_matches) == 0:
-                raise ValueError(f"Expected 'City / Town' column not found in JSON table for {state}/{stage}. Columns: {list(pdf.columns)}")
-            city_col_name = city_col_matches.values[0]
-            pdf['City/Town'] = pdf[city_col_name].apply(lambda x: x.split(' (')[0].strip())
-            ## EPA renamed 'Facility Name' to 'Applicant / Facility Name' around 2025
-            facility_col = 'Facility Name' if 'Facility Name' in pdf.columns else 'Applicant / Facility Name'
-            if facility_col not in pdf.columns:
-                raise ValueError(f"Expected facility name column not found for {state}/{stage}. Columns: {list(pdf.columns)}")
-            pdf['Facility Name'] = pdf[facility_col]
-            pdf['Facility_name_clean'] = pdf['Facility Name'].apply(lambda x: BeautifulSoup(x).text.split(' (PDF')[0].split('\n')[0].split("in new window.'>")[-1])
-            pdf['Permit_URL'] = pdf['Facility Name'].apply(lambda x: [
-                BeautifulSoup(x).findAll('a')[j].get('href')
-                for j in range(len(BeautifulSoup(x, features="lxml").findAll('a')))
-            ])
-            pdf['Stage'] = stage
-            pdf['State'] = state
-            pdf['Watershed'] = pdf[city_col_name].apply(lambda x: x.split('(')[1][:-1].strip() if '(' in x else np.nan)
-            
-            ## Add to list readout
-            for i in range(len(pdf)):
-                permit_data += [dict(pdf.iloc[i])]
-        
-        ## HTML table
-        else:
-            print('Parsing html table')
-            soup = BeautifulSoup(content, 'lxml')
-            
-            table = soup.findAll('tr')
-            header = [table[0].findAll('th')[i].get_text() for i in range(len(table[0].findAll('th')))]
-
-            print(f'Iterating over N={len(table[1:])} rows')
-            for row in table[1:]:
-                if 'Facility Name' not in row.text:
-                    
-                    permit_data += [{}]
-                    
-                    permit_data[-1]['Stage'] = stage
-                    permit_data[-1]['State'] = state
-                    
-                    for i,col in enumerate(header):
-                        if '<td>' in str(row):
-                            element = row.findAll('td')[i]
-                        elif '<th>' in str(row):
-                            element = row.findAll('th')[i]
-                        else:
-                            raise ValueError('Missing expected HTML elements in table')
-                        
-                        permit_data[-1][col] = unidecode(element.get_text())
-                        
-                        if permit_data[-1][col] == 'N/A':
-                            nullcol = 1
-                            permit_data[-1][col] = np.nan
-                        else:
-                            nullcol = 0
-                        
-                        if stage == 'draft':
-                            
-                            permit_data[-1]['Watershed'] = np.nan
-                            
-                            if col == 'Comment Period Dates':
-                                if nullcol == 0 and '-' not in permit_data[-1][col]: nullcol=1
-                                if nullcol:
-                                    for cc in ['Comment_date_start', 'Comment_date_end', 'Comment_date_extension']:
-                                        permit_data[-1][cc] = np.nan
-                                else:
-                                    permit_data[-1]['Comment_date_start'] = permit_data[-1][col].split('-')[0].strip()
-                                    permit_data[-1]['Comment_date_end'] = permit_data[-1][col].split('-')[1].split(' (')[0].strip()
-                                    permit_data[-1]['Comment_date_extension'] = permit_data[-1][col].split()[-1][:-1] if ('Extended' in permit_data[-1][col] or 'Re-opening' in permit_data[-1][col]) else np.nan
-                        
-                        if stage == 'final':
-                            if 'Watershed' in col:
-                                if '(' in permit_data[-1][col]:
-                                    permit_data[-1]['Watershed'] = permit_data[-1][col].split('(')[1][:-1].strip()
-                                else:
-                                    permit_data[-1]['Watershed'] = np.nan
-                                permit_data[-1]['City/Town'] = permit_data[-1][col].split(' (')[0].strip()
-                                
-                            if 'Issuance' in col:
-                                permit_data[-1]['Date of Issuance'] = permit_data[-1][col]
-                            
-                        if col == 'Facility Name':
-                            permit_data[-1]['Facility_name_clean'] = permit_data[-1][col].split(' (PDF')[0].split('\n')[0]
-                            if '(PDF' in permit_data[-1][col]:
-                                permit_data[-1]['Permit_URL'] = ['https://www3.epa.gov/region1/npdes/' + element.findAll('a')[j].get('href') for j in range(len(element.findAll('a')))]
-                            else:
-                                permit_data[-1]['Permit_URL'] = np.nan
-
+                print('Parsing html table')
+                page_data[state, stage] = parse_html_table(content, state, stage)
+    permit_data = [row for state, stage, _ in pages for row in page_data[state, stage]]
 
     permit_df = pd.DataFrame(permit_data)
 
     if len(permit_df) < 500:
         raise ValueError(f"Only {len(permit_df)} permits parsed — expected at least 500. Aborting to avoid overwriting good data.")
 
-    os.system('mkdir '+PERMIT_DIR.split('/')[0])
-
-    ## Build a set of PDF filenames already in GCS with a single listing call.
-    ## This lets us skip both the download and upload for existing PDFs, keeping
-    ## the sync incremental whether running locally or in CI.
-    print('Listing existing PDFs in GCS...')
-    gs_ls = os.popen('gsutil ls "gs://openamend-data/EPA_Region1_NPDES_permits/**"').read()
-    existing_in_gcs = set(os.path.basename(p) for p in gs_ls.splitlines() if p.strip())
-    print(f'Found {len(existing_in_gcs)} files already in GCS.')
-
-    out_files = []
-    new_pdf_count = 0
+    ## Each PDF URL is synced once, however many permit rows link to it; its key in the
+    ## old per-permit layout comes from the first row that links to it
+    legacy_keys = {}
     for i in range(len(permit_df)):
         row = permit_df.iloc[i]
-        state = row['State']
-        stage = row['Stage']
-        permitID = row['Permit Number']
         if row['Permit_URL'] is not np.nan:
-            out_files += [[]]
             for permit in row['Permit_URL']:
-                # Skip anything that isn't a direct PDF link (avoids downloading
-                # HTML listing pages, anchor fragments, etc.)
-                if not permit.lower().split('?')[0].split('#')[0].endswith('.pdf'):
-                    continue
-                out_path = PERMIT_DIR.format(state, stage, permitID)
-                for i in range(1,len(out_path.split('/'))):
-                    check_path = '/'.join(out_path.split('/')[:i])
-                    if os.path.exists(check_path) == 0:
-                        os.system('mkdir '+check_path)
-                filename = permit.split('/')[-1]
-                local_file = out_path + filename
-                gs_file = GS_URL.format(state, stage, permitID) + filename
-                out_files[-1] += [gs_file]
-                # Check by the stored filename (includes permitID prefix from out_path)
-                stored_filename = os.path.basename(local_file)
-                if stored_filename not in existing_in_gcs:
-                    os.system('wget '+permit+' --no-clobber --timeout=30 --tries=3 -O ' + local_file)
-                    if os.path.exists(local_file):
-                        os.system('gsutil cp ' + local_file + ' gs://openamend-data/' + local_file)
-                        new_pdf_count += 1
-        else:
-            out_files += [['']]
+                if is_pdf_link(permit) and permit not in legacy_keys:
+                    legacy_keys[permit] = PERMIT_DIR.format(row['State'], row['Stage'], row['Permit Number']) + permit.split('/')[-1]
+
+    backend = storage_backend()
+    manifest = load_manifest()
+    if len(manifest) == 0:
+        ## Adopt PDFs already stored under the per-permit layout, recording their
+        ## validators from a HEAD request instead of downloading them again
+        print('No PDF manifest; listing PDFs already stored...')
+        stored = backend.list(PDF_STORE_DIR + '/')
+        adopted = [SyncJob(url, None, key=key) for url, key in legacy_keys.items() if key in stored]
+        print(f'Checking {len(adopted)} stored PDFs...')
+        probe_files(adopted)
+        manifest = {job.url: manifest_record(job) for job in adopted if job.error is None}
+    stored_keys = set(rec['key'] for rec in manifest.values())
 
-    print(f'Uploaded {new_pdf_count} new PDFs to GCS.')
-    ## access at e.g. https://storage.googleapis.com/openamend-data/EPA_Region1_NPDES_permits/nh/final/NH0000116_finalnh0000116permit.pdf
+    ## Known PDFs are requested conditionally.  PDFs whose server sent no validators
+    ## cannot be checked without downloading them and are kept as they are.
+    sync_jobs = []
+    for url, legacy_key in legacy_keys.items():
+        rec = manifest.get(url)
+        local_file = os.path.join(PDF_STORE_DIR, 'downloads', legacy_key[len(PDF_STORE_DIR) + 1:].replace('/', '_'))
+        if rec is None:
+            sync_jobs += [SyncJob(url, local_file)]
+        elif rec['etag'] or rec['last_modified']:
+            sync_jobs += [SyncJob(url, local_file, key=rec['key'], etag=rec['etag'] or None, last_modified=rec['last_modified'] or None)]
+
+    print(f'Checking {len(sync_jobs)} PDFs ({sum(url not in manifest for url in legacy_keys)} new)...')
+    sync_stats = sync_files(sync_jobs, backend, key_func=content_key, stored_keys=stored_keys)
+    for job in sync_jobs:
+        ## A job without an error has its key in storage (uploaded now or before); failed
+        ## jobs keep their previous record, or none, so they are retried on the next run
+        if job.error is not None:
+            continue
+        if job.unchanged:
+            manifest[job.url]['checked'] = manifest_record(job)['checked']
+        else:
+            manifest[job.url] = manifest_record(job)
+    save_manifest(manifest)
+    print(f'Uploaded {sync_stats.uploaded} new or changed PDFs.')
+    ## access at e.g. https://storage.googleapis.com/openamend-data/EPA_Region1_NPDES_permits/sha256/3f/3f...pdf
+    ## (see the key column of the manifest)
 
     ## Write out data
     permit_df.to_pickle('EPARegion1_NPDES_permit_data.p')
     permit_df.rename(columns = {c:c.replace(' ','_') for c in permit_df.columns}, inplace=True)
     # NOTE: UTF8 outputs break tables in jekyll!  http://support.markedapp.com/discussions/problems/18583-rendering-tables-with-kramdown
-    permit_df.to_csv('../docs/data/EPARegion1_NPDES_permit_data.csv', index=0, encoding='ascii')
+    permit_df.to_csv(data_path('EPARegion1_NPDES_permit_data.csv'), index=0, encoding='ascii')
 
 
     # ------------------------------
@@ -249,6 +338,6 @@ if __name__ == '__main__':
     # ------------------------------
 
     ## Report last update
-    with open('../docs/data/ts_update_EPARegion1_NPDES_permit.yml', 'w') as f:
+    with open(data_path('ts_update_EPARegion1_NPDES_permit.yml'), 'w') as f:
         f.write('updated: '+str(datetime.datetime.now()).split('.')[0]+'\n')
 
@@ -1,12 +1,13 @@
 """Download Environmental agency budget data from the MassBudget website.
 """
 
-import requests
 import datetime
 import os
 import pandas as pd
 from io import StringIO
 
+from http_cache import cached_get
+
 ## Download "All Line Items" spreasdsheet linked here: http://massbudget.org/browser/subcat.php?id=Environment&inflation=cpi#line_items
 MASSBUDGET_URL = 'https://massbudget.org/wp-content/themes/astra-child/browser-assets/spreadsheet.php?id=Environment&inflation=cpi&level=subcat'
 
@@ -25,7 +26,7 @@ def fix_commas(df: pd.DataFrame) -> None:
 
 
 if __name__ == '__main__':
-	mb_csv = requests.get(MASSBUDGET_URL).content.decode('utf-8')
+	mb_csv = cached_get(MASSBUDGET_URL).content.decode('utf-8')
 	## File has a summary table and two separate line-item level tables
 
 	#########################
@@ -10,27 +10,43 @@ Key implementation notes:
   - The CSOAPI requires a Referer header pointing to the portal page; bare requests
     return HTTP 500.  The REQ_HEADER below must be kept in sync with the portal URL.
   - The API is 1-indexed (pageNumber starts at 1, not 0).
-  - Timestamps are ISO 8601 but may or may not include milliseconds; use format='ISO8601'.
+  - Pages are fetched concurrently (MAX_WORKERS threads, one pooled session with retries
+    per thread) once the page count is known, either from a count field in the response
+    or by probing for the last non-empty page.
+  - Raw records from all pages are collected and converted to a single DataFrame at the
+    end; timestamps are ISO 8601 but may or may not include milliseconds, so they are
+    parsed once with format='ISO8601'.
   - The API returns a lowercase 'year' column; we drop it to avoid a case-insensitive
     name collision with our added 'Year' column when writing to SQLite.
+  - Runs are incremental when EEADP_CSO.csv already exists: only incidents dated within
+    INCREMENTAL_LOOKBACK_DAYS of the newest submittedDate in the snapshot are requested
+    (IncidentFromDate/IncidentToDate), and they replace snapshot rows with the same
+    incidentId.  The lookback covers reports submitted or revised well after the incident;
+    run with --full to rebuild the table from scratch.
 
 Example API URL:
   https://eeaonline.eea.state.ma.us/dep/CSOAPI/api/Incident/GetIncidentsBySearchFields/
     ?ReporterClass=Verified%20Data%20Report&IncidentFromDate=01/01/2022
     &IncidentToDate=08/02/2023&RainfallDataFrom=1&pageNumber=2&pageSize=50
 
-Outputs:
+Outputs (in ../docs/data, or AMEND_OUTPUT_DIR if set):
   ../docs/data/EEADP_CSO.csv         — full CSO incident table
   ../docs/data/EEADP_CSO_sample.csv  — 10-row random sample
   ../docs/data/ts_update_EEADP_CSO.yml — timestamp of last run
 """
 
-import requests
+import math
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 
 import datetime
 import pandas as pd
 
+from date_utils import add_date_parts, parse_dates
+from table_io import data_path
+from http_cache import cached_get, get_session
+
 # The CSOAPI requires a Referer header matching the portal page; plain User-Agent requests return 500.
 REQ_HEADER = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
@@ -39,70 +55,208 @@ REQ_HEADER = {
     'Accept': 'application/json, text/plain, */*',
 }
 
-API_BASE_URL = 'https://eeaonline.eea.state.ma.us/dep/CSOAPI/api/Incident/GetIncidentsBySearchFields/?pageSize=50&'
+PAGE_SIZE = 50
+API_BASE_URL = f'https://eeaonline.eea.state.ma.us/dep/CSOAPI/api/Incident/GetIncidentsBySearchFields/?pageSize={PAGE_SIZE}&'
+
+# Pages requested at once; each worker thread keeps its own pooled, retrying session
+MAX_WORKERS = 8
+
+# Pages are revalidated through the shared HTTP cache; raise to replay cached pages
+CACHE_TTL = 0
+
+# Response fields that may carry the total number of matching incidents
+COUNT_KEYS = ('totalCount', 'totalRecords', 'totalItems', 'total', 'count')
+
+CSO_CSV = data_path('EEADP_CSO.csv')
+
+# Timestamp columns, ISO 8601 with or without milliseconds
+DATE_COLS = ('incidentDate', 'submittedDate')
+
+# Incremental runs re-request incidents dated this many days before the newest submittedDate
+# in the existing table, so late submissions and revised reports are picked up
+INCREMENTAL_LOOKBACK_DAYS = 180
+
+# Date format expected by the IncidentFromDate / IncidentToDate filters
+QUERY_DATE_FORMAT = '%m/%d/%Y'
 
 def update_query_time():
     """Update the yml file that indicates the time of last query.
     """
-    with open('../docs/data/ts_update_EEADP_CSO.yml', 'w') as f:
+    with open(data_path('ts_update_EEADP_CSO.yml'), 'w') as f:
         f.write('updated: '+str(datetime.datetime.now()).split('.')[0]+'\n')
 
-def _query_page(page: int, query_params: Optional[dict[str, str]]=None) -> Optional[pd.DataFrame]:
-    """Query for and return a single page of API results.
+def _query_json(page: int, query_params: Optional[dict[str, str]]=None) -> dict:
+    """Request a single page of API results and return the decoded JSON body."""
+    query_params = dict(query_params or {}, pageNumber=page)
+    query_string = '&'.join(f'{key}={val}' for key, val in query_params.items())
+    r = cached_get(API_BASE_URL + query_string, session=get_session(), ttl=CACHE_TTL, headers=REQ_HEADER)
+    r.raise_for_status()
+    return r.json()
+
+def _query_page(page: int, query_params: Optional[dict[str, str]]=None) -> Optional[list[dict]]:
+    """Query for and return the raw incident records on a single page of API results.
 
-    If the resulting query is empty, return Non
+    If the resulting query is empty, return None
     """
     print(f'Querying for page {page}')
-    if query_params is None:
-        query_params = {}
-    query_params['pageNumber'] = page
-    query_string = '&'.join(f'{key}={val}' for key, val in query_params.items())
-    r = requests.get(API_BASE_URL + query_string, headers=REQ_HEADER)
-    if len(r.json()['results']) > 0:
-        return pd.concat([pd.Series(c) for c in r.json()['results']], axis=1).T
+    results = _query_json(page, query_params)['results']
+    if len(results) > 0:
+        return results
     else:
         return None
 
-def run_query() -> pd.DataFrame:
+def records_to_frame(records: list[dict]) -> pd.DataFrame:
+    """Build one typed DataFrame from raw incident records.
+
+    Columns are built directly from the records (numeric fields get numeric dtypes) and the
+    incidentDate/submittedDate timestamps are parsed once for the whole table.  Integer
+    fields with missing values (e.g. hours, minutes) become nullable Int64 rather than
+    float64, so they are written as "5", not "5.0".
+    """
+    df = pd.DataFrame.from_records(records)
+    for col in df.columns[df.dtypes == 'float64']:
+        if all(isinstance(r.get(col), int) for r in records if r.get(col) is not None):
+            df[col] = df[col].astype('Int64')
+    for col in DATE_COLS:
+        if col in df.columns:
+            df[col] = parse_dates(df[col])
+    return df
+
+def _page_count(query_params: Optional[dict[str, str]]=None) -> int:
+    """Return the number of non-empty pages for a query.
+
+    Uses the total count from the first page if the API reports one; otherwise probes
+    pages at doubling offsets until one is empty, then bisects for the last full page.
+    """
+    first = _query_json(1, query_params)
+    count_keys = {k.lower() for k in COUNT_KEYS}
+    for key, val in first.items():
+        if key.lower() in count_keys and isinstance(val, int):
+            return math.ceil(val / PAGE_SIZE)
+    if len(first['results']) == 0:
+        return 0
+
+    def has_results(page: int) -> bool:
+        return len(_query_json(page, query_params)['results']) > 0
+
+    last_full, first_empty = 1, 2
+    while has_results(first_empty):
+        last_full, first_empty = first_empty, first_empty * 2
+    while first_empty - last_full > 1:
+        mid = (last_full + first_empty) // 2
+        if has_results(mid):
+            last_full = mid
+        else:
+            first_empty = mid
+    return last_full
+
+def run_query(query_params: Optional[dict[str, str]]=None, max_workers: int=MAX_WORKERS) -> pd.DataFrame:
     """Run a full query, paging through results and returning a combined DataFrame.
+
+    The page count is determined up front so pages can be requested concurrently;
+    records are collected in page order and converted to a DataFrame once at the end.
+    Pages that turn out empty (e.g. if the count changed mid-run) are skipped, and paging
+    continues past the counted pages until an empty one is found.
     """
-    print('Running full query')
-    page = 1  # CSOAPI is 1-indexed
-    result_dfs = []
-    while True:
-        df = _query_page(page)
-        if df is None:
-            break
-        result_dfs.append(df)
+    print('Running query')
+    n_pages = _page_count(query_params)
+    print(f'Fetching {n_pages} pages with {max_workers} workers')
+    records = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # CSOAPI is 1-indexed
+        for results in executor.map(lambda page: _query_page(page, query_params), range(1, n_pages + 1)):
+            if results is not None:
+                records.extend(results)
+    # Pick up any incidents added while paging
+    page = n_pages + 1
+    while (results := _query_page(page, query_params)) is not None:
+        records.extend(results)
         page += 1
-    return pd.concat(result_dfs)
+    return records_to_frame(records)
+
+def load_snapshot(csv_path: str=CSO_CSV) -> Optional[pd.DataFrame]:
+    """Return the previously written CSO table, or None if there is none to update.
+
+    Cells are kept as text so that rows which are not re-queried are written back unchanged
+    (e.g. zero-padded outfallIds); only the date columns are parsed.
+    """
+    try:
+        df = pd.read_csv(csv_path, index_col=0, dtype=str, keep_default_na=False, na_values=[''])
+    except FileNotFoundError:
+        return None
+    if len(df) == 0 or 'incidentId' not in df.columns or 'submittedDate' not in df.columns:
+        return None
+    for col in DATE_COLS:
+        if col in df.columns:
+            df[col] = parse_dates(df[col])
+    return df
 
-def get_data() -> pd.DataFrame:
+def window_params(snapshot: pd.DataFrame, lookback_days: int=INCREMENTAL_LOOKBACK_DAYS) -> Optional[dict[str, str]]:
+    """Return IncidentFromDate/IncidentToDate filters covering the trailing window to re-query.
+
+    The window starts `lookback_days` before the newest submittedDate in the snapshot and runs
+    through tomorrow, so it includes anything submitted today.  Returns None if the snapshot has
+    no usable dates.
+    """
+    last_submitted = snapshot['submittedDate'].max()
+    if pd.isna(last_submitted):
+        return None
+    start = last_submitted - datetime.timedelta(days=lookback_days)
+    end = datetime.datetime.now() + datetime.timedelta(days=1)
+    return {
+        'IncidentFromDate': start.strftime(QUERY_DATE_FORMAT),
+        'IncidentToDate': end.strftime(QUERY_DATE_FORMAT),
+    }
+
+def upsert(snapshot: pd.DataFrame, updates: pd.DataFrame, key: str='incidentId') -> pd.DataFrame:
+    """Replace snapshot rows whose `key` appears in `updates` and append the new ones.
+    """
+    if len(updates) == 0:
+        return snapshot
+    updates = updates.drop_duplicates(subset=key, keep='last')
+    kept = snapshot[~snapshot[key].astype(str).isin(updates[key].astype(str))]
+    print(f'Replacing {len(snapshot) - len(kept)} and adding {len(updates) - (len(snapshot) - len(kept))} incidents')
+    return pd.concat([kept, updates], ignore_index=True)
+
+def get_data(incremental: bool=True) -> pd.DataFrame:
     """Query data from the data portal API and do any necessary post processing.
+
+    With `incremental`, only the trailing window since the last submitted report is queried
+    and merged into the existing table; otherwise (or if there is no usable table yet) all
+    incidents are queried.
     """
-    df = run_query()
-    df['incidentDate'] = pd.to_datetime(df['incidentDate'], format='ISO8601')
-    df['submittedDate'] = pd.to_datetime(df['submittedDate'], format='ISO8601')
+    snapshot = load_snapshot() if incremental else None
+    params = window_params(snapshot) if snapshot is not None else None
+    columns = list(snapshot.columns) if params is not None else None
+    if params is None:
+        df = run_query()
+    else:
+        print(f"Updating {len(snapshot)} incidents from {params['IncidentFromDate']} to {params['IncidentToDate']}")
+        df = upsert(snapshot, run_query(params))
     # API already returns a lowercase 'year' column; drop it before adding 'Year'
     # to avoid duplicate column names (case-insensitive collision in SQLite).
+    # The API's own 'month' column is kept, so no 'Month' part is added here.
     df.drop(columns=[c for c in df.columns if c.lower() == 'year'], inplace=True)
-    df['Year'] = df['incidentDate'].apply(lambda x: x.year)
+    df = add_date_parts(df, 'incidentDate', parts=('Year', 'FiscalYear'))
+    if columns is not None:
+        # Keep the existing table's column order, with any new API fields at the end
+        df = df[[c for c in columns if c in df.columns] + [c for c in df.columns if c not in columns]]
     return df
 
 def write_data(df: pd.DataFrame):
     """Write data to a local table for integration with AMEND.
     """
     print('Writing out queries data')
-    df.to_csv('../docs/data/EEADP_CSO.csv', index=True)
+    df.to_csv(CSO_CSV, index=True)
     ## Print a sample of the file as an example
-    df.sample(n=10).to_csv('../docs/data/EEADP_CSO_sample.csv', index=0)
+    df.sample(n=10).to_csv(data_path('EEADP_CSO_sample.csv'), index=0)
 
-def main():
+def main(incremental: bool=True):
     """Query and write all data.
     """
-    all_data = get_data()
+    all_data = get_data(incremental=incremental)
     write_data(all_data)
     update_query_time()
 
 if __name__ == '__main__':
-    main()
+    main(incremental='--full' not in sys.argv[1:])
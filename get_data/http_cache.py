@@ -0,0 +1,234 @@
+"""On-disk HTTP response cache shared by the get_data fetchers.
+
+Responses are stored under CACHE_DIR keyed by URL, one body file plus a small JSON metadata
+file per entry.  A cached response is served without any request while it is younger than
+the caller's TTL; after that it is revalidated with If-None-Match / If-Modified-Since when
+the server sent an ETag or Last-Modified, and a 304 reply reuses the stored body.  Responses
+with neither a validator nor a positive TTL are never written, so by default nothing is
+cached that could not be checked for changes.  When the cache grows past MAX_CACHE_BYTES the
+least recently used entries are deleted.
+
+Set AMEND_HTTP_CACHE_TTL (seconds) to override every caller's TTL, e.g. to replay a previous
+run's responses while debugging a parser, or AMEND_HTTP_CACHE_DIR to move the cache.
+Set AMEND_UPSTREAM_URL (e.g. http://localhost:8765) to send every request to that host
+instead of the real one, such as the local stand-in server in mock_upstream.py.
+
+The retrying Session used by every fetcher is also defined here (`make_session`,
+`get_session`), so they share one retry policy.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Optional
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util.retry import Retry
+
+CACHE_DIR = os.environ.get('AMEND_HTTP_CACHE_DIR', 'http_cache')
+
+# Least recently used entries are evicted once the bodies stored exceed this many bytes
+MAX_CACHE_BYTES = 2 * 1024**3
+
+# Seconds a response is served without revalidation; 0 means always revalidate
+DEFAULT_TTL = 0
+
+_TTL_OVERRIDE = os.environ.get('AMEND_HTTP_CACHE_TTL')
+
+UPSTREAM_URL = os.environ.get('AMEND_UPSTREAM_URL')
+
+def resolve_url(url: str) -> str:
+	"""Return `url` with its scheme and host replaced by UPSTREAM_URL, if that is set."""
+	if not UPSTREAM_URL:
+		return url
+	upstream = urlsplit(UPSTREAM_URL)
+	return urlunsplit(urlsplit(url)._replace(scheme=upstream.scheme, netloc=upstream.netloc))
+
+def retrying_adapter() -> HTTPAdapter:
+	"""Return a transport adapter that retries 429 and 5xx responses 5 times with exponential backoff."""
+	retry = Retry(
+		total=5,
+		backoff_factor=2,
+		status_forcelist=[429, 500, 502, 503, 504],
+	)
+	return HTTPAdapter(max_retries=retry)
+
+def make_session() -> requests.Session:
+	"""Return a requests Session with automatic retries on transient errors."""
+	session = requests.Session()
+	session.mount('http://', retrying_adapter())
+	session.mount('https://', retrying_adapter())
+	return session
+
+_thread_local = threading.local()
+
+def get_session() -> requests.Session:
+	"""Return the calling thread's retrying Session, creating it on first use.
+
+	Sessions are not shared between threads, so each worker of a fetcher's thread pool keeps
+	its own pooled connections.
+	"""
+	if not hasattr(_thread_local, 'session'):
+		_thread_local.session = make_session()
+	return _thread_local.session
+
+def _tmp_path(path: str) -> str:
+	"""Return a temporary file name for writing `path`, unique to this process and thread."""
+	return f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+
+class HTTPCache:
+	"""A directory of cached GET responses with TTLs, conditional revalidation and LRU eviction."""
+	def __init__(self, cache_dir: str=CACHE_DIR, max_bytes: int=MAX_CACHE_BYTES):
+		self.cache_dir = cache_dir
+		self.max_bytes = max_bytes
+		self.lock = threading.Lock()
+		self._size = None
+		os.makedirs(cache_dir, exist_ok=True)
+
+	def _paths(self, url: str) -> tuple:
+		key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+		base = os.path.join(self.cache_dir, key)
+		return base + '.body', base + '.json'
+
+	def _load(self, url: str) -> Optional[dict]:
+		body_path, meta_path = self._paths(url)
+		try:
+			with open(meta_path) as f:
+				meta = json.load(f)
+		except (FileNotFoundError, ValueError):
+			return None
+		if meta.get('url') != url or not os.path.exists(body_path):
+			return None
+		return meta
+
+	def _response(self, url: str, meta: dict) -> requests.Response:
+		"""Rebuild a Response from a cache entry and mark the entry as recently used."""
+		body_path, _ = self._paths(url)
+		with open(body_path, 'rb') as f:
+			content = f.read()
+		os.utime(body_path)
+		r = requests.Response()
+		r.url = url
+		r.status_code = meta['status']
+		r.headers = CaseInsensitiveDict(meta['headers'])
+		r.encoding = requests.utils.get_encoding_from_headers(r.headers)
+		r._content = content
+		r.from_cache = True
+		return r
+
+	def _store(self, url: str, r: requests.Response):
+		body_path, meta_path = self._paths(url)
+		old_size = os.path.getsize(body_path) if os.path.exists(body_path) else 0
+		tmp_path = _tmp_path(body_path)
+		with open(tmp_path, 'wb') as f:
+			f.write(r.content)
+		os.replace(tmp_path, body_path)
+		self._write_meta(url, {
+			'url': url,
+			'status': r.status_code,
+			'headers': dict(r.headers),
+			'etag': r.headers.get('ETag'),
+			'last_modified': r.headers.get('Last-Modified'),
+			'stored': time.time(),
+		})
+		with self.lock:
+			if self._size is not None:
+				self._size += len(r.content) - old_size
+		self.evict()
+
+	def _write_meta(self, url: str, meta: dict):
+		_, meta_path = self._paths(url)
+		tmp_path = _tmp_path(meta_path)
+		with open(tmp_path, 'w') as f:
+			json.dump(meta, f)
+		os.replace(tmp_path, meta_path)
+
+	def get(self, url: str, session: Optional[requests.Session]=None, ttl: float=DEFAULT_TTL, headers: Optional[dict]=None, **kwargs) -> requests.Response:
+		"""
+		GET `url` through the cache.
+
+		Args:
+			url (str): Full URL, including any query string (it is the cache key)
+			session (Session): Session to send requests on, e.g. one with retries or
+				required headers; a plain request is made if None
+			ttl (float): Seconds a stored response may be served without revalidation
+			headers (dict): Extra request headers
+			**kwargs: Passed on to `session.get`
+
+		Returns:
+			Response: The live response, or one rebuilt from the cache with
+				`from_cache = True`
+		"""
+		if _TTL_OVERRIDE is not None:
+			ttl = float(_TTL_OVERRIDE)
+		url = resolve_url(url)
+		meta = self._load(url)
+		if meta is not None and time.time() - meta['stored'] < ttl:
+			return self._response(url, meta)
+		headers = dict(headers or {})
+		if meta is not None:
+			if meta.get('etag'):
+				headers['If-None-Match'] = meta['etag']
+			if meta.get('last_modified'):
+				headers['If-Modified-Since'] = meta['last_modified']
+		r = (session or requests).get(url, headers=headers, **kwargs)
+		if r.status_code == 304 and meta is not None:
+			meta['stored'] = time.time()
+			self._write_meta(url, meta)
+			return self._response(url, meta)
+		r.from_cache = False
+		cacheable = ttl > 0 or 'ETag' in r.headers or 'Last-Modified' in r.headers
+		if r.status_code == 200 and cacheable and len(r.content) <= self.max_bytes:
+			self._store(url, r)
+		return r
+
+	def evict(self):
+		"""Delete least recently used entries until the stored bodies fit in max_bytes."""
+		with self.lock:
+			if self._size is not None and self._size <= self.max_bytes:
+				return
+			entries = []
+			for fn in os.listdir(self.cache_dir):
+				if fn.endswith('.body'):
+					path = os.path.join(self.cache_dir, fn)
+					stat = os.stat(path)
+					entries.append((stat.st_mtime, stat.st_size, path))
+			self._size = sum(size for _, size, _ in entries)
+			for _, size, path in sorted(entries):
+				if self._size <= self.max_bytes:
+					break
+				for fn in (path, path[:-len('.body')] + '.json'):
+					try:
+						os.remove(fn)
+					except FileNotFoundError:
+						pass
+				self._size -= size
+
+	def clear(self):
+		"""Delete every cached response."""
+		with self.lock:
+			for fn in os.listdir(self.cache_dir):
+				os.remove(os.path.join(self.cache_dir, fn))
+			self._size = 0
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_cache() -> HTTPCache:
+	"""Return the process-wide cache in CACHE_DIR, creating it on first use."""
+	global _default_cache
+	with _default_cache_lock:
+		if _default_cache is None:
+			_default_cache = HTTPCache()
+		return _default_cache
+
+def cached_get(url: str, session: Optional[requests.Session]=None, ttl: float=DEFAULT_TTL, headers: Optional[dict]=None, **kwargs) -> requests.Response:
+	"""GET `url` through the shared cache; see `HTTPCache.get`."""
+	return get_cache().get(url, session=session, ttl=ttl, headers=headers, **kwargs)
@@ -0,0 +1,409 @@
+"""Local stand-in for the upstream APIs used by the get_data fetchers.
+
+Serves, on one port, the endpoints the fetch scripts call:
+  - EEA DataLake tables        /EEA/DataLake/V1.0/DataLakeAPI/<table>?_start=&_end=
+  - CSOAPI incident search     /dep/CSOAPI/api/Incident/GetIncidentsBySearchFields/
+  - Socrata (SODA) resources   /resource/<dataset>.json?$limit=&$offset=, with a
+                               "year >= N" $where filter and $select=count(*)
+  - EPA Region 1 NPDES pages   /npdes-permits/<state>-<stage>-individual-npdes-permits,
+                               plus the JSON tables and PDFs they link to
+
+Responses are synthetic by default, generated deterministically from the row index so
+repeated runs see the same data, with the table size set by the --rows/--incidents/
+--staff/--permits options.  With --record DIR, requests are instead forwarded to the real
+upstream hosts and each response is saved in DIR; with --replay DIR, saved responses are
+served back (falling back to synthetic data for anything not recorded).  --latency,
+--jitter and --failure-rate add per-request delay and injected error responses, to
+benchmark throughput and exercise the retry paths offline.
+
+Point the fetchers at the server with AMEND_UPSTREAM_URL (see http_cache.py), use a
+separate cache directory so the mock responses do not mix with real ones, and write the
+tables to a scratch AMEND_OUTPUT_DIR (see table_io.py) rather than over docs/data/:
+
+  python mock_upstream.py --port 8765 --latency 0.2 --failure-rate 0.05 &
+  AMEND_UPSTREAM_URL=http://localhost:8765 AMEND_HTTP_CACHE_DIR=http_cache_mock \\
+      AMEND_OUTPUT_DIR=/tmp/amend_mock_data python get_eea_dp_cso.py --full
+
+run_mock_fetchers.sh does this for several fetchers and checks their outputs.
+
+A summary of requests served, bytes sent and failures injected is printed on exit.
+"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import random
+import re
+import signal
+import sys
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+from get_EEA_data_portal import TABLE_SCHEMAS
+
+# Real hosts behind each path prefix, used in --record mode; anything else is an EPA page
+UPSTREAMS = (
+	('/EEA/DataLake/', 'http://eeaonline.eea.state.ma.us'),
+	('/dep/CSOAPI/', 'https://eeaonline.eea.state.ma.us'),
+	('/resource/', 'https://cthru.data.socrata.com'),
+	)
+DEFAULT_UPSTREAM = 'https://www.epa.gov'
+
+# Headers not copied between the client, the upstream host and the recorded fixtures
+HOP_HEADERS = {'host', 'connection', 'accept-encoding', 'content-encoding', 'content-length', 'transfer-encoding', 'keep-alive'}
+
+# Columns the fetchers read from the DataLake tables beyond the typed ones in TABLE_SCHEMAS
+EXTRA_COLUMNS = {
+	'drinkingWater': ['PWSId', 'LocationName', 'Result', 'ResultWithUnit', 'DefContamLimitWithUnits'],
+	}
+
+# Distinct values generated for each categorical column
+N_CATEGORIES = 8
+
+MOCK_PDF_PATH = '/system/files/documents/mock-npdes/'
+MOCK_JSON_PATH = '/sites/default/files/mock-npdes/'
+
+STATES = {'connecticut': 'ct', 'maine': 'me', 'new-hampshire': 'nh', 'massachusetts': 'ma', 'rhode-island': 'ri', 'vermont': 'vt'}
+STAGES = ('final', 'draft')
+
+
+##########################
+## Synthetic data
+##########################
+
+def _iso(day: datetime.date) -> str:
+	return day.strftime('%Y-%m-%dT%H:%M:%S')
+
+def _day(rng: random.Random, start_year: int=2000) -> datetime.date:
+	"""Return a random date between Jan 1 of `start_year` and today."""
+	start = datetime.date(start_year, 1, 1)
+	return start + datetime.timedelta(days=rng.randrange((datetime.date.today() - start).days + 1))
+
+def _value(rng: random.Random, col: str, kind: str, i: int):
+	if kind == 'datetime':
+		return _iso(_day(rng))
+	if kind == 'float':
+		return round(rng.uniform(0, 1000), 2)
+	if kind == 'Int64':
+		return i + 1 if col == 'Id' else rng.randrange(1, 100000)
+	if kind == 'boolean':
+		return rng.random() < 0.8
+	if kind == 'category':
+		return f'{col} {rng.randrange(N_CATEGORIES)}'
+	return f'{col} {rng.randrange(1000)}'
+
+def eea_row(table: str, i: int) -> dict:
+	"""Return row `i` of a synthetic DataLake table."""
+	rng = random.Random(f'{table}:{i}')
+	row = {'Id': i + 1}
+	for col, kind in TABLE_SCHEMAS[table].items():
+		row[col] = _value(rng, col, kind, i)
+	for col in EXTRA_COLUMNS.get(table, ()):
+		row[col] = _value(rng, col, 'string', i)
+	return row
+
+def cso_incident(i: int) -> dict:
+	"""Return synthetic CSO incident `i`."""
+	rng = random.Random(f'cso:{i}')
+	incident = _day(rng, 2022)
+	submitted = min(incident + datetime.timedelta(days=rng.randrange(60)), datetime.date.today())
+	return {
+		'incidentId': hashlib.md5(f'cso:{i}'.encode()).hexdigest(),
+		'incidentDate': _iso(incident),
+		'submittedDate': _iso(submitted) + ('.%03d' % rng.randrange(1000) if rng.random() < 0.5 else ''),
+		'year': incident.year,
+		'month': incident.month,
+		'permiteeName': f'Permittee {rng.randrange(40)}',
+		'municipality': f'Town {rng.randrange(60)}',
+		'outfallId': f'{rng.randrange(1, 300):03d}',
+		'waterBody': f'River {rng.randrange(25)}',
+		'latitude': round(rng.uniform(41.2, 42.9), 5),
+		'longitude': round(rng.uniform(-73.5, -69.9), 5),
+		'volumnOfEvent': round(rng.uniform(0, 5), 3),
+		'reporterClass': rng.choice(['Verified Data Report', 'Public Notification']),
+		}
+
+def soda_row(i: int) -> dict:
+	"""Return synthetic payroll record `i`; SODA returns every value as a string."""
+	rng = random.Random(f'soda:{i}')
+	base = rng.uniform(30000, 150000)
+	overtime = rng.choice([0, 0, 0, rng.uniform(0, 20000)])
+	return {
+		'bargaining_group_title': f'Unit {rng.randrange(12)}',
+		'contract': f'{rng.randrange(1, 12):02d}',
+		'department_division': 'DEPARTMENT OF ENVIRONMENTAL PROTECTION (EQE)',
+		'department_location_zip_code': f'0{rng.randrange(1000, 2800)}',
+		'name_first': f'First{i}',
+		'name_last': f'Last{i}',
+		'pay_base_actual': '%.2f' % base,
+		'pay_buyout_actual': '0.00',
+		'pay_overtime_actual': '%.2f' % overtime,
+		'pay_total_actual': '%.2f' % (base + overtime),
+		'position_title': f'Environmental Analyst {rng.randrange(1, 6)}',
+		'position_type': rng.choice(['Full Time', 'Part Time']),
+		'year': str(2010 + i % (datetime.date.today().year - 2009)),
+		}
+
+def npdes_rows(state: str, stage: str, n: int) -> list:
+	"""Return the rows of a synthetic NPDES JSON table in the {"data": [...]} format."""
+	rows = []
+	for k in range(n):
+		rng = random.Random(f'npdes:{state}:{stage}:{k}')
+		permit_id = f'{state.upper()}{k:07d}'
+		pdf = f'{DEFAULT_UPSTREAM}{MOCK_PDF_PATH}{state}/{stage}/{permit_id.lower()}{stage}permit.pdf'
+		row = {
+			'Permit Number': permit_id,
+			'Applicant / Facility Name': f"<a href='{pdf}' title='Opens in new window.'>Facility {k} (PDF)</a>",
+			'City / Town (Watershed)': f'Town {rng.randrange(60)} (River {rng.randrange(25)})',
+			}
+		day = _day(rng, 2010)
+		if stage == 'final':
+			row['Date of Issuance'] = day.strftime('%m/%d/%Y')
+		else:
+			end = day + datetime.timedelta(days=30)
+			row['Comment Period Dates'] = day.strftime('%m/%d/%Y') + ' - ' + end.strftime('%m/%d/%Y')
+		rows.append(row)
+	return rows
+
+def npdes_page(state: str, stage: str) -> str:
+	"""Return a listing page that loads its table from a JSON file, like the EPA pages."""
+	return (f"<html><body><table id='datatable'></table><script>"
+		f"var jsonURL = '{MOCK_JSON_PATH}{state}-{stage}.json';"
+		f"$('#datatable').DataTable({{'ajax': jsonURL}});</script></body></html>")
+
+def pdf_body(path: str, n_bytes: int) -> bytes:
+	"""Return deterministic PDF-like bytes for a permit file."""
+	seed = hashlib.sha256(path.encode()).digest()
+	return b'%PDF-1.4\n' + (seed * (n_bytes // len(seed) + 1))[:max(n_bytes - 9, 0)]
+
+
+##########################
+## Server
+##########################
+
+class MockUpstream:
+	"""Configuration, request routing and counters shared by the handler threads."""
+	def __init__(self, args):
+		self.args = args
+		self.rng = random.Random(args.seed)
+		self.lock = threading.Lock()
+		self.requests = 0
+		self.bytes = 0
+		self.failures = 0
+		self.recorded = 0
+		self.started = time.monotonic()
+		self.started_at = time.time()
+		for fixture_dir in (args.record, args.replay):
+			if fixture_dir:
+				os.makedirs(fixture_dir, exist_ok=True)
+
+	def fixture_paths(self, path: str) -> tuple:
+		key = hashlib.sha256(path.encode('utf-8')).hexdigest()
+		base = os.path.join(self.args.record or self.args.replay, key)
+		return base + '.body', base + '.json'
+
+	def should_fail(self) -> bool:
+		with self.lock:
+			return self.rng.random() < self.args.failure_rate
+
+	def delay(self):
+		with self.lock:
+			seconds = self.args.latency + self.rng.uniform(0, self.args.jitter)
+		if seconds > 0:
+			time.sleep(seconds)
+
+	def count(self, n_bytes: int, failed: bool=False):
+		with self.lock:
+			self.requests += 1
+			self.bytes += n_bytes
+			self.failures += failed
+
+	def record(self, path: str, headers: dict) -> tuple:
+		"""Forward a request to the real host and save the response as a fixture."""
+		upstream = next((host for prefix, host in UPSTREAMS if path.startswith(prefix)), DEFAULT_UPSTREAM)
+		r = requests.get(upstream + path, headers=headers, timeout=300)
+		out_headers = {k: v for k, v in r.headers.items() if k.lower() not in HOP_HEADERS}
+		body_path, meta_path = self.fixture_paths(path)
+		with open(body_path, 'wb') as f:
+			f.write(r.content)
+		with open(meta_path, 'w') as f:
+			json.dump({'path': path, 'status': r.status_code, 'headers': out_headers}, f, indent=1)
+		with self.lock:
+			self.recorded += 1
+		return r.status_code, out_headers, r.content
+
+	def replay(self, path: str):
+		"""Return a saved (status, headers, body) for `path`, or None if it was not recorded."""
+		body_path, meta_path = self.fixture_paths(path)
+		if not os.path.exists(meta_path):
+			return None
+		with open(meta_path) as f:
+			meta = json.load(f)
+		with open(body_path, 'rb') as f:
+			return meta['status'], meta['headers'], f.read()
+
+	def synthesize(self, path: str):
+		"""Return a synthetic (status, headers, body) for `path`, or None for unknown paths."""
+		url = urlsplit(path)
+		query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+		parts = url.path.rstrip('/').split('/')
+		args = self.args
+
+		if url.path.startswith('/EEA/DataLake/'):
+			table = parts[-1]
+			if table not in TABLE_SCHEMAS:
+				return 500, {}, b'{"Message": "An error has occurred."}'
+			start = int(query.get('_start', 0))
+			end = min(int(query.get('_end', args.rows)), args.rows)
+			items = [eea_row(table, i) for i in range(start, end)]
+			return self.json_response({'Items': items, 'TotalCount': args.rows})
+
+		if url.path.startswith('/dep/CSOAPI/'):
+			page = int(query.get('pageNumber', 1))
+			page_size = int(query.get('pageSize', 50))
+			incidents = (cso_incident(i) for i in range(args.incidents))
+			if 'IncidentFromDate' in query or 'IncidentToDate' in query:
+				lo = _iso(datetime.datetime.strptime(query.get('IncidentFromDate', '01/01/1900'), '%m/%d/%Y'))
+				hi = _iso(datetime.datetime.strptime(query.get('IncidentToDate', '12/31/2999'), '%m/%d/%Y'))
+				incidents = (c for c in incidents if lo <= c['incidentDate'] <= hi)
+			incidents = list(incidents)
+			return self.json_response({'results': incidents[(page - 1) * page_size:page * page_size]})
+
+		if url.path.startswith('/resource/'):
+			offset = int(query.get('$offset', 0))
+			limit = int(query.get('$limit', 1000))
+			min_year = re.search(r'\byear\s*>=\s*(\d+)', query.get('$where', ''))
+			count = re.match(r'count\(\*\)(?:\s+as\s+(\w+))?$', query.get('$select', ''), re.IGNORECASE)
+			if min_year is None and count is None:
+				return self.json_response([soda_row(i) for i in range(offset, min(offset + limit, args.staff))])
+			rows = [soda_row(i) for i in range(args.staff)]
+			if min_year is not None:
+				rows = [r for r in rows if int(r['year']) >= int(min_year.group(1))]
+			if count is not None:
+				return self.json_response([{count.group(1) or 'count': str(len(rows))}])
+			return self.json_response(rows[offset:offset + limit])
+
+		if url.path.startswith('/npdes-permits/'):
+			state_name, _, stage = parts[-1].split('-individual-npdes-permits')[0].rpartition('-')
+			state = STATES.get(state_name)
+			if state is None or stage not in STAGES:
+				return None
+			return self.static_response(npdes_page(state, stage).encode(), 'text/html; charset=utf-8')
+
+		if url.path.startswith(MOCK_JSON_PATH):
+			state, stage = parts[-1][:-len('.json')].split('-')
+			return self.static_response(json.dumps({'data': npdes_rows(state, stage, args.permits)}).encode(), 'application/json')
+
+		if url.path.startswith(MOCK_PDF_PATH):
+			return self.static_response(pdf_body(url.path, args.pdf_bytes), 'application/pdf')
+
+		return None
+
+	def json_response(self, obj) -> tuple:
+		return 200, {'Content-Type': 'application/json; charset=utf-8'}, json.dumps(obj).encode()
+
+	def static_response(self, body: bytes, content_type: str) -> tuple:
+		"""Serve unchanging content with validators, as the EPA web server does."""
+		headers = {
+			'Content-Type': content_type,
+			'ETag': '"' + hashlib.md5(body).hexdigest() + '"',
+			'Last-Modified': formatdate(self.started_at - 86400, usegmt=True),
+			}
+		return 200, headers, body
+
+	def summary(self) -> str:
+		seconds = time.monotonic() - self.started
+		return (f'{self.requests} requests, {self.bytes / 1e6:.1f} MB sent, {self.failures} failures injected, '
+			f'{self.recorded} recorded in {seconds:.0f} s')
+
+
+class MockHandler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+	mock = None
+
+	def respond(self, send_body: bool):
+		mock = self.mock
+		mock.delay()
+		if mock.should_fail():
+			body = b'{"Message": "Injected failure"}'
+			self.send(mock.args.failure_status, {'Content-Type': 'application/json'}, body, send_body)
+			mock.count(len(body), failed=True)
+			return
+		response = None
+		if mock.args.record:
+			headers = {k: v for k, v in self.headers.items() if k.lower() not in HOP_HEADERS}
+			response = mock.record(self.path, headers)
+		elif mock.args.replay:
+			response = mock.replay(self.path)
+		if response is None:
+			response = mock.synthesize(self.path)
+		if response is None:
+			response = 404, {'Content-Type': 'text/plain'}, b'Not found'
+		status, headers, body = response
+		etag = headers.get('ETag')
+		if status == 200 and etag is not None and self.headers.get('If-None-Match') == etag:
+			status, body = 304, b''
+		self.send(status, headers, body, send_body)
+		mock.count(len(body) if send_body else 0)
+
+	def send(self, status: int, headers: dict, body: bytes, send_body: bool):
+		self.send_response(status)
+		for key, val in headers.items():
+			self.send_header(key, val)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		if send_body:
+			self.wfile.write(body)
+
+	def do_GET(self):
+		self.respond(send_body=True)
+
+	def do_HEAD(self):
+		self.respond(send_body=False)
+
+	def log_message(self, format, *args):
+		if self.mock.args.verbose:
+			super().log_message(format, *args)
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+	parser.add_argument('--port', type=int, default=8765)
+	parser.add_argument('--latency', type=float, default=0., help='Seconds added to every response')
+	parser.add_argument('--jitter', type=float, default=0., help='Up to this many extra random seconds per response')
+	parser.add_argument('--failure-rate', type=float, default=0., help='Fraction of requests answered with --failure-status')
+	parser.add_argument('--failure-status', type=int, default=503)
+	parser.add_argument('--rows', type=int, default=10000, help='Rows in each DataLake table')
+	parser.add_argument('--incidents', type=int, default=2000, help='CSO incidents')
+	parser.add_argument('--staff', type=int, default=20000, help='Payroll records')
+	parser.add_argument('--permits', type=int, default=100, help='Permits on each NPDES state/stage page')
+	parser.add_argument('--pdf-bytes', type=int, default=200000, help='Size of each permit PDF')
+	parser.add_argument('--seed', type=int, default=0, help='Seed for injected latency and failures')
+	fixtures = parser.add_mutually_exclusive_group()
+	fixtures.add_argument('--record', metavar='DIR', help='Forward requests to the real hosts and save the responses in DIR')
+	fixtures.add_argument('--replay', metavar='DIR', help='Serve responses saved with --record from DIR')
+	parser.add_argument('--verbose', action='store_true', help='Log every request')
+	args = parser.parse_args()
+
+	MockHandler.mock = MockUpstream(args)
+	server = ThreadingHTTPServer(('localhost', args.port), MockHandler)
+	server.daemon_threads = True
+	print(f'Serving mock upstream APIs at http://localhost:{args.port}', flush=True)
+	signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		print(MockHandler.mock.summary(), flush=True)
+
+if __name__ == '__main__':
+	main()
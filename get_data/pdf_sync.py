@@ -0,0 +1,305 @@
+"""Download files and copy them to object storage with a bounded pool of workers.
+
+Used by get_EPARegion1_NPDES_permits.py to sync permit PDFs.  Each file is streamed to a
+local path on a pooled, retrying session while its size and sha256 are computed; a file is
+only uploaded if it is non-empty, matches the Content-Length the server reported and, when
+an expected hash is given, that hash.  Verified files are uploaded in batches through a
+storage backend: GCSBackend copies each batch with one `gsutil -m cp -r` call, and
+LocalBackend copies into a directory (useful for tests and for running without GCS
+credentials).  Throughput and failures are printed as the sync proceeds.
+
+Jobs that carry the ETag / Last-Modified of a previous download are requested
+conditionally, so unchanged files cost a 304 rather than a transfer.  Storage keys can be
+derived from the content hash once a file is downloaded (content-addressed storage), in
+which case files whose key is already stored are not uploaded again.
+"""
+
+import hashlib
+import os
+import shlex
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional
+
+import requests
+
+from http_cache import get_session, resolve_url
+
+# Downloads in flight at once
+MAX_WORKERS = 8
+
+# Verified files are uploaded this many at a time
+UPLOAD_BATCH_SIZE = 50
+
+CHUNK_BYTES = 1024**2
+
+
+class SyncJob:
+	"""One file to sync: where to download it from, where to keep it locally and its storage key.
+
+	`etag` and `last_modified` are the validators from the last time the file was fetched;
+	if either is set the download is conditional and `unchanged` is set on a 304 reply.
+	"""
+	def __init__(self, url: str, local_path: str, key: Optional[str]=None, sha256: Optional[str]=None, etag: Optional[str]=None, last_modified: Optional[str]=None, size: Optional[int]=None):
+		self.url = url
+		self.local_path = local_path
+		self.key = key
+		self.sha256 = sha256
+		self.etag = etag
+		self.last_modified = last_modified
+		self.size = size
+		self.unchanged = False
+		self.error = None
+
+	def validator_headers(self) -> dict:
+		headers = {}
+		if self.etag:
+			headers['If-None-Match'] = self.etag
+		if self.last_modified:
+			headers['If-Modified-Since'] = self.last_modified
+		return headers
+
+	def update_validators(self, r: requests.Response):
+		self.etag = r.headers.get('ETag', self.etag)
+		self.last_modified = r.headers.get('Last-Modified', self.last_modified)
+
+
+class GCSBackend:
+	"""Google Cloud Storage bucket, accessed with the gsutil command line tool."""
+	def __init__(self, bucket_url: str='gs://openamend-data'):
+		self.bucket_url = bucket_url.rstrip('/')
+
+	def list(self, prefix: str) -> set:
+		"""Return the keys of all objects under `prefix` with a single listing call."""
+		gs_ls = os.popen('gsutil ls "' + self.bucket_url + '/' + prefix + '**"').read()
+		return set(p[len(self.bucket_url) + 1:] for p in gs_ls.splitlines() if p.startswith(self.bucket_url + '/'))
+
+	def upload(self, jobs: list) -> list:
+		"""Upload the jobs' local files with one recursive copy; returns the jobs that failed.
+
+		The files are linked into a temporary tree laid out like their keys, so a batch spread
+		over many key prefixes still takes a single `gsutil -m cp -r` call.
+		"""
+		failed = []
+		staged = []
+		with tempfile.TemporaryDirectory(prefix='upload_', dir=os.path.dirname(jobs[0].local_path) or '.') as staging:
+			for job in jobs:
+				dest = os.path.join(staging, job.key)
+				try:
+					os.makedirs(os.path.dirname(dest), exist_ok=True)
+					try:
+						os.link(job.local_path, dest)
+					except OSError:
+						shutil.copyfile(job.local_path, dest)
+				except OSError as e:
+					job.error = str(e)
+					failed.append(job)
+					continue
+				staged.append(job)
+			if staged:
+				sources = ' '.join(shlex.quote(os.path.join(staging, fn)) for fn in sorted(os.listdir(staging)))
+				if os.system('gsutil -m -q cp -r ' + sources + ' ' + shlex.quote(self.bucket_url + '/')) != 0:
+					failed += staged
+		return failed
+
+
+class LocalBackend:
+	"""A local directory standing in for a bucket; keys are paths relative to it."""
+	def __init__(self, root: str):
+		self.root = root
+
+	def list(self, prefix: str) -> set:
+		keys = set()
+		for dirpath, _, filenames in os.walk(os.path.join(self.root, prefix)):
+			for fn in filenames:
+				keys.add(os.path.relpath(os.path.join(dirpath, fn), self.root).replace(os.sep, '/'))
+		return keys
+
+	def upload(self, jobs: list) -> list:
+		failed = []
+		for job in jobs:
+			dest = os.path.join(self.root, job.key)
+			try:
+				os.makedirs(os.path.dirname(dest), exist_ok=True)
+				shutil.copyfile(job.local_path, dest)
+			except OSError as e:
+				job.error = str(e)
+				failed.append(job)
+		return failed
+
+
+def file_sha256(path: str) -> str:
+	sha = hashlib.sha256()
+	with open(path, 'rb') as f:
+		for chunk in iter(lambda: f.read(CHUNK_BYTES), b''):
+			sha.update(chunk)
+	return sha.hexdigest()
+
+def probe(job: SyncJob, timeout: float=30) -> SyncJob:
+	"""Fill in a job's validators and size from a HEAD request, without downloading it."""
+	r = get_session().head(resolve_url(job.url), timeout=timeout, allow_redirects=True)
+	r.raise_for_status()
+	job.update_validators(r)
+	if r.headers.get('Content-Length') is not None:
+		job.size = int(r.headers['Content-Length'])
+	return job
+
+def probe_files(jobs: list, max_workers: int=MAX_WORKERS) -> list:
+	"""Probe jobs concurrently; returns the jobs that failed, with their `error` set."""
+	failed = []
+	with ThreadPoolExecutor(max_workers=max_workers) as executor:
+		futures = {executor.submit(probe, job): job for job in jobs}
+		for future in as_completed(futures):
+			try:
+				future.result()
+			except requests.RequestException as e:
+				futures[future].error = str(e)
+				failed.append(futures[future])
+	return failed
+
+def download(job: SyncJob, timeout: float=30) -> SyncJob:
+	"""Stream `job.url` to `job.local_path`, verifying its size and hash.
+
+	If the job has validators the request is conditional, and a 304 reply only sets
+	`job.unchanged`.  Otherwise an existing local file is reused instead of downloaded
+	again.  Raises ValueError if the download is empty, truncated or does not match
+	`job.sha256`.
+	"""
+	os.makedirs(os.path.dirname(job.local_path) or '.', exist_ok=True)
+	headers = job.validator_headers()
+	if not headers and os.path.exists(job.local_path) and os.path.getsize(job.local_path) > 0:
+		job.size = os.path.getsize(job.local_path)
+		digest = file_sha256(job.local_path)
+	else:
+		sha = hashlib.sha256()
+		size = 0
+		tmp_path = job.local_path + '.part'
+		with get_session().get(resolve_url(job.url), headers=headers, stream=True, timeout=timeout) as r:
+			if r.status_code == 304:
+				job.unchanged = True
+				return job
+			r.raise_for_status()
+			job.update_validators(r)
+			with open(tmp_path, 'wb') as f:
+				for chunk in r.iter_content(CHUNK_BYTES):
+					f.write(chunk)
+					sha.update(chunk)
+					size += len(chunk)
+			expected_size = r.headers.get('Content-Length')
+		if size == 0 or (expected_size is not None and 'Content-Encoding' not in r.headers and int(expected_size) != size):
+			os.remove(tmp_path)
+			raise ValueError(f'Received {size} of {expected_size} bytes')
+		os.replace(tmp_path, job.local_path)
+		job.size = size
+		digest = sha.hexdigest()
+	if job.sha256 is not None and not headers and digest != job.sha256:
+		os.remove(job.local_path)
+		raise ValueError(f'sha256 {digest} does not match expected {job.sha256}')
+	job.sha256 = digest
+	return job
+
+
+class SyncStats:
+	"""Running totals for a sync, printed as progress lines."""
+	def __init__(self, n_jobs: int):
+		self.n_jobs = n_jobs
+		self.downloaded = 0
+		self.unchanged = 0
+		self.duplicates = 0
+		self.uploaded = 0
+		self.bytes = 0
+		self.failed = []
+		self.started = time.monotonic()
+
+	def rate(self) -> float:
+		return self.bytes / max(time.monotonic() - self.started, 1e-9)
+
+	def report(self) -> str:
+		return (f'{self.downloaded}/{self.n_jobs} downloaded, {self.unchanged} unchanged, {self.duplicates} already stored, '
+			f'{self.uploaded} uploaded, {len(self.failed)} failed, '
+			f'{self.bytes / 1e6:.1f} MB at {self.rate() / 1e6:.2f} MB/s')
+
+
+def sync_files(jobs: list, backend, max_workers: int=MAX_WORKERS, batch_size: int=UPLOAD_BATCH_SIZE, verbose: bool=True, key_func=None, stored_keys: Optional[set]=None) -> SyncStats:
+	"""
+	Download each job's file on a worker pool and upload verified files to `backend` in batches.
+
+	Args:
+		jobs (list): SyncJob objects
+		backend: A GCSBackend or LocalBackend (anything with `upload(jobs) -> failed jobs`)
+		max_workers (int): Downloads in flight at once
+		batch_size (int): Files per upload call
+		verbose (bool): Print progress after each upload batch
+		key_func (callable): If given, called with each downloaded job to set its storage
+			key (e.g. from `job.sha256`); the local file is renamed to the key's file name
+		stored_keys (set): Keys already in storage, which are not uploaded again; keys
+			uploaded by this sync are added to it once their upload succeeds
+
+	Returns:
+		SyncStats: Totals, including the jobs that failed with their `error` set.  A job
+			whose content duplicates a file uploaded in this sync only succeeds if that
+			upload does, so a job without `error` always has its key in storage.
+	"""
+	stats = SyncStats(len(jobs))
+	stored_keys = set() if stored_keys is None else stored_keys
+	batch = []
+	## Jobs waiting on the upload of an identical file, by key
+	waiting = {}
+
+	def flush():
+		failed = backend.upload(batch)
+		failed_ids = set(id(job) for job in failed)
+		for job in failed:
+			job.error = job.error or 'upload failed'
+		stats.failed += failed
+		stats.uploaded += len(batch) - len(failed)
+		for job in batch:
+			duplicates = waiting.pop(job.key)
+			if id(job) in failed_ids:
+				for dup in duplicates:
+					dup.error = 'upload of ' + job.key + ' failed'
+				stats.failed += duplicates
+			else:
+				stored_keys.add(job.key)
+				stats.duplicates += len(duplicates)
+		batch.clear()
+		if verbose:
+			print(stats.report())
+
+	with ThreadPoolExecutor(max_workers=max_workers) as executor:
+		futures = {executor.submit(download, job): job for job in jobs}
+		for future in as_completed(futures):
+			job = futures[future]
+			try:
+				future.result()
+			except (requests.RequestException, ValueError, OSError) as e:
+				job.error = str(e)
+				stats.failed.append(job)
+				print(f'Failed to download {job.url}: {e}')
+				continue
+			if job.unchanged:
+				stats.unchanged += 1
+				continue
+			stats.downloaded += 1
+			stats.bytes += job.size
+			if key_func is not None:
+				job.key = key_func(job)
+				local_path = os.path.join(os.path.dirname(job.local_path), os.path.basename(job.key))
+				os.replace(job.local_path, local_path)
+				job.local_path = local_path
+			if job.key in stored_keys:
+				stats.duplicates += 1
+				continue
+			if job.key in waiting:
+				waiting[job.key].append(job)
+				continue
+			waiting[job.key] = []
+			batch.append(job)
+			if len(batch) >= batch_size:
+				flush()
+	if batch:
+		flush()
+	print('PDF sync: ' + stats.report())
+	return stats
@@ -0,0 +1,109 @@
+#!/bin/bash
+# Run the fetchers that mock_upstream.py stands in for against it, twice (a full run, then
+# an incremental one) where they support it, and check that they write their tables to a scratch AMEND_OUTPUT_DIR
+# without touching the committed docs/data/ files.
+#
+# Used by the Mock Fetchers workflow; can also be run locally from any directory:
+#   bash get_data/run_mock_fetchers.sh
+
+set -euo pipefail
+
+GET_DATA=$(cd "$(dirname "$0")" && pwd)
+PORT=${MOCK_PORT:-8765}
+EEA_ROWS=5000
+WORK=$(mktemp -d)
+
+port_open() {
+	python -c "import socket; socket.create_connection(('localhost', $PORT), 1)" 2>/dev/null
+}
+if port_open; then
+	echo "Port $PORT is already in use; set MOCK_PORT to a free port"
+	exit 1
+fi
+
+## 50 permits per listing page clears the NPDES fetcher's 500-permit sanity check
+python "$GET_DATA/mock_upstream.py" --port "$PORT" --failure-rate 0.02 \
+	--rows $EEA_ROWS --incidents 500 --staff 2000 --permits 50 --pdf-bytes 4096 > "$WORK/mock.log" 2>&1 &
+MOCK_PID=$!
+trap 'kill $MOCK_PID 2>/dev/null; cat "$WORK/mock.log"; rm -rf "$WORK"' EXIT
+
+## Wait for the server to accept connections
+for i in $(seq 50); do
+	port_open && break
+	sleep 0.2
+done
+if ! kill -0 $MOCK_PID 2>/dev/null; then
+	echo "mock_upstream.py did not start"
+	exit 1
+fi
+
+export AMEND_UPSTREAM_URL=http://localhost:$PORT
+export AMEND_HTTP_CACHE_DIR=$WORK/http_cache
+export AMEND_OUTPUT_DIR=$WORK/data
+export AMEND_PDF_STORE=$WORK/pdf_store
+mkdir -p "$AMEND_OUTPUT_DIR"
+
+## Scripts keep their local working files (caches, downloads, credentials) in the current directory
+cd "$WORK"
+printf 'mock-app-token\nmock-secret-token\n' > SECRET_SODA_token
+docs_before=$(git -C "$GET_DATA" status --porcelain -- ../docs)
+
+for flag in --full ""; do
+	python "$GET_DATA/get_eea_dp_cso.py" $flag
+	python "$GET_DATA/get_DEP_staff_SODA.py" $flag
+done
+python "$GET_DATA/get_EPARegion1_NPDES_permits.py"
+
+## The EEA DataLake tables go through run_table rather than main(), which also archives the
+## portal's PDFs into docs/.  drinkingWater is left out: its snapshot lives on GCS (gsutil).
+## The incremental pass uses a small req_size so only the tail is fetched and merged.
+EEA_TABLES="permit facility inspection enforcement"
+python - "$GET_DATA" $EEA_TABLES <<'PY'
+import sys
+sys.path.insert(0, sys.argv[1])
+from get_EEA_data_portal import run_table, sync_table
+from table_io import data_path
+for tab in sys.argv[2:]:
+	run_table(tab, incremental=False)
+for tab in sys.argv[2:]:
+	sync_table(tab, data_path('EEADP_' + tab + '.csv'), req_size=1000)
+PY
+
+status=0
+outputs="EEADP_CSO.csv MADEP_staff_SODA.csv EPARegion1_NPDES_permit_data.csv EPARegion1_NPDES_permit_pdfs.csv"
+for tab in $EEA_TABLES; do
+	outputs="$outputs EEADP_$tab.csv"
+done
+for fn in $outputs; do
+	if [ ! -s "$AMEND_OUTPUT_DIR/$fn" ]; then
+		echo "MISSING OUTPUT: $fn"
+		status=1
+	else
+		echo "$fn: $(($(wc -l < "$AMEND_OUTPUT_DIR/$fn") - 1)) rows"
+	fi
+done
+## Each EEA table has the mock's EEA_ROWS rows, and the sync state records the same count
+if ! python - "$AMEND_OUTPUT_DIR" $EEA_ROWS $EEA_TABLES <<'PY'
+import json, os, sys
+import pandas as pd
+out_dir, expected = sys.argv[1], int(sys.argv[2])
+with open(os.path.join(out_dir, 'EEADP_sync_state.json')) as f:
+	state = json.load(f)
+ok = True
+for tab in sys.argv[3:]:
+	n_rows = len(pd.read_csv(os.path.join(out_dir, 'EEADP_' + tab + '.csv'), usecols=['Id']))
+	count = state.get(tab, {}).get('count')
+	if not n_rows == count == expected:
+		print('EEADP_' + tab + ': ' + str(n_rows) + ' rows, sync state count ' + str(count) + ', expected ' + str(expected))
+		ok = False
+sys.exit(0 if ok else 1)
+PY
+then
+	status=1
+fi
+if [ "$(git -C "$GET_DATA" status --porcelain -- ../docs)" != "$docs_before" ]; then
+	echo "docs/ was modified by a mock run:"
+	git -C "$GET_DATA" status --porcelain -- ../docs
+	status=1
+fi
+exit $status
@@ -0,0 +1,44 @@
+"""Read data tables from docs/data/, preferring typed Parquet copies over CSV.
+
+Fetch scripts that can (e.g. get_EEA_data_portal.py) write a Parquet file next to each
+CSV with the same base name.  Reading the Parquet copy keeps column types (categoricals,
+datetimes, nullable integers) and avoids re-parsing the CSV text.  The CSV stays the
+canonical, human-readable output; a Parquet copy is only used if it is at least as new.
+"""
+
+import os
+import pandas as pd
+
+# Fetch scripts write their tables here (relative to get_data/).  Set AMEND_OUTPUT_DIR to write
+# them somewhere else, e.g. when running against mock_upstream.py, so committed data is untouched.
+DATA_DIR = os.environ.get('AMEND_OUTPUT_DIR', '../docs/data')
+
+def data_path(filename: str) -> str:
+	"""Return the path of an output file in DATA_DIR."""
+	return os.path.join(DATA_DIR, filename)
+
+def parquet_path(csv_path) -> str:
+	"""Return the path of the Parquet copy that corresponds to a CSV path."""
+	return os.path.splitext(str(csv_path))[0] + '.parquet'
+
+def has_parquet(csv_path) -> bool:
+	"""True if a Parquet copy exists, is not older than the CSV, and pyarrow can read it."""
+	pq_path = parquet_path(csv_path)
+	if not os.path.exists(pq_path):
+		return False
+	if os.path.exists(csv_path) and os.path.getmtime(pq_path) < os.path.getmtime(csv_path):
+		return False
+	try:
+		import pyarrow
+	except ImportError:
+		return False
+	return True
+
+def read_table(csv_path, **kwargs) -> pd.DataFrame:
+	"""Load a table from its Parquet copy if available, otherwise from the CSV.
+
+	Keyword arguments are passed to `pd.read_csv` only.
+	"""
+	if has_parquet(csv_path):
+		return pd.read_parquet(parquet_path(csv_path))
+	return pd.read_csv(csv_path, **kwargs)